@@ -1,17 +1,31 @@
 from flask import Flask
 import os
 
-from app.config import UPLOAD_FOLDER, ALLOWED_EXTENSIONS
+from app.config import (
+    UPLOAD_FOLDER,
+    ALLOWED_EXTENSIONS,
+    MAX_CONTENT_LENGTH,
+    WARMUP_ON_STARTUP,
+    TRUSTED_PROXY_HOPS,
+)
 from app.database import init_db
+from app.warmup import StartupTimer, enable_bytecode_cache, warm_up
 
 
 def create_app():
+    timer = StartupTimer()
+
     app = Flask(
         __name__,
         template_folder="templates",
         static_folder="static"
     )
 
+    # multipart file parts go through the storage backend's checks as they
+    # are parsed (see app/storage.py)
+    from app.storage import SpooledUploadRequest
+    app.request_class = SpooledUploadRequest
+
     # -----------------------------
     # SECRET KEY (MANDATORY)
     # -----------------------------
@@ -26,20 +40,78 @@ def create_app():
     # -----------------------------
     app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
     app.config["ALLOWED_EXTENSIONS"] = ALLOWED_EXTENSIONS
+    # rejected from Content-Length before the body is read
+    app.config["MAX_CONTENT_LENGTH"] = MAX_CONTENT_LENGTH
+
+    # -----------------------------
+    # ADMIN REQUEST PROFILER (?_profile=1)
+    # -----------------------------
+    # registered first so the other request hooks show up in profiles
+    from app.profiler import init_profiler
+    init_profiler(app)
+
+    # -----------------------------
+    # CLIENT ADDRESS BEHIND THE ROUTER
+    # -----------------------------
+    # remote_addr becomes the address our own proxies saw, not whatever
+    # the client wrote into X-Forwarded-For
+    if TRUSTED_PROXY_HOPS:
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS, x_proto=TRUSTED_PROXY_HOPS)
+
+    from app.models import rupees
+    app.add_template_filter(rupees)
+
+    enable_bytecode_cache(app)
 
     # -----------------------------
     # INITIALIZE DATABASE (SAFE)
     # -----------------------------
-    with app.app_context():
+    with timer.phase("init_db"), app.app_context():
         init_db()
 
     # -----------------------------
     # BLUEPRINTS
     # -----------------------------
-    from app.routes import main
-    app.register_blueprint(main)
+    with timer.phase("blueprints"):
+        from app.routes import main
+        app.register_blueprint(main)
+
+        from app.admin_routes import admin
+        app.register_blueprint(admin)
+
+    # -----------------------------
+    # STATIC FILES
+    # -----------------------------
+    from app.static_files import init_static_serving
+    init_static_serving(app)
+
+    # -----------------------------
+    # ADMISSION CONTROL
+    # -----------------------------
+    from app.ratelimit import init_rate_limiting
+    init_rate_limiting(app)
+
+    # -----------------------------
+    # CROSS-WORKER CACHE INVALIDATION
+    # -----------------------------
+    # started lazily so each forked gunicorn worker gets its own thread
+    from app.listener import start_listener
+    app.before_request(start_listener)
+
+    # -----------------------------
+    # CLI (flask worker / flask jobs)
+    # -----------------------------
+    from app.cli import register_commands
+    register_commands(app)
+
+    # -----------------------------
+    # WARM-UP (before gunicorn forks when preload_app is on)
+    # -----------------------------
+    if WARMUP_ON_STARTUP:
+        with app.app_context():
+            warm_up(app, timer)
 
-    from app.admin_routes import admin
-    app.register_blueprint(admin)
+    timer.report()
 
     return app
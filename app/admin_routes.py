@@ -1,11 +1,38 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session
-import json, os, uuid
+from flask import Blueprint, Response, render_template, stream_template, request, redirect, url_for, session, jsonify, send_file
+import json, os, re
 from functools import wraps
-from app.config import ADMIN_USERNAME, ADMIN_PASSWORD
-from datetime import datetime
+from app.config import ADMIN_USERNAME, ADMIN_PASSWORD, ORDER_SEARCH_LIMIT
+from datetime import date, datetime
 from werkzeug.utils import secure_filename
 from urllib.parse import quote
 from app.database import get_db
+from app import jobs
+from app.models import Order, rupees, to_paise
+from app.storage import get_storage, UploadError
+from app.reports import REPORT_RANGES, load_sales_report, mark_order_changed
+from app.order_feed import notify_order_changed, open_stream
+from app.dispatch import load_dispatch_plan
+from app.archive import load_archived_order
+from app.stock import (
+    ensure_shards,
+    rebalance,
+    order_quantities,
+    restock,
+    take_stock,
+    fold_sold_stock,
+    RESTOCK_ON_DELETE,
+)
+from app.invoices import render_invoice, invalidate_invoice, load_invoice_orders
+from app.order_history import invalidate_order_history
+from app.profiler import list_profiles, profile_path
+from app.catalog import (
+    load_admin_product_cards,
+    load_product_for_edit,
+    load_category_facets,
+    refresh_category_facets,
+    notify_catalog_changed,
+    invalidate_product,
+)
 
 admin = Blueprint("admin", __name__, url_prefix="/admin")
 
@@ -45,20 +72,16 @@ def load_orders():
         cur.execute("SELECT * FROM orders ORDER BY id DESC")
         rows = cur.fetchall()
 
-        orders = []
-        for o in rows:
-            cur.execute(
-                "SELECT name, price, quantity FROM order_items WHERE order_id = %s",
-                (o["id"],)
-            )
-            items = cur.fetchall()
-
-            orders.append({
-                **dict(o),
-                "items": [dict(i) for i in items]
-            })
+        cur.execute(
+            """SELECT order_id, product_id, name, price, quantity
+               FROM order_items WHERE order_id = ANY(%s) ORDER BY id""",
+            ([o["id"] for o in rows],)
+        )
+        items = {}
+        for i in cur.fetchall():
+            items.setdefault(i["order_id"], []).append(i)
 
-        return orders
+        return [Order.from_row(o, items.get(o["id"], ())) for o in rows]
     finally:
         conn.close()
 
@@ -77,21 +100,139 @@ def load_order(order_id):
         order = cur.fetchone()
 
         if not order:
-            return None
+            # older months live in gzip files once archived
+            return load_archived_order(order_id, cur)
 
+        # the order date selects the order_items partition
         cur.execute(
-            "SELECT name, price, quantity FROM order_items WHERE order_id = %s",
-            (order_id,)
+            """SELECT product_id, name, price, quantity FROM order_items
+               WHERE order_id = %s AND order_created_at IS NOT DISTINCT FROM %s
+               ORDER BY id""",
+            (order_id, order["created_at"])
         )
-        items = cur.fetchall()
+        return Order.from_row(order, cur.fetchall())
+    finally:
+        conn.close()
 
-        return {
-            **dict(order),
-            "items": [dict(i) for i in items]
-        }
+
+def _has_trgm(cur):
+    cur.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+    return cur.fetchone() is not None
+
+
+def search_orders(q, limit=ORDER_SEARCH_LIMIT):
+    """Orders matching an id, phone prefix or (fuzzy) name/address, best first."""
+    q = q.strip()
+    digits = re.sub(r"\D", "", q)
+
+    conn = get_db()
+    if not conn:
+        return []
+
+    try:
+        cur = conn.cursor()
+        # each branch yields (id, rank) from an index and is capped on its own
+        branches, params = [], []
+
+        if digits and re.fullmatch(r"[\d\s#+()-]+", q):
+            if len(digits) <= 9:
+                branches.append("SELECT id, 3.0 AS rank FROM orders WHERE id = %s")
+                params.append(int(digits))
+            if len(digits) >= 3:
+                # phones are stored as typed at checkout, usually without +91
+                if len(digits) > 10 and digits.startswith("91"):
+                    digits = digits[2:]
+                branches.append("""(SELECT id, 2.0 AS rank FROM orders
+                    WHERE phone LIKE %s ORDER BY id DESC LIMIT %s)""")
+                params += [digits + "%", limit]
+        elif len(q) >= 3:
+            pattern = "%" + re.sub(r"([%_\\])", r"\\\1", q) + "%"
+            if _has_trgm(cur):
+                branches.append("""(SELECT id,
+                        greatest(similarity(name, %s), similarity(address, %s)) AS rank
+                    FROM orders
+                    WHERE name ILIKE %s OR address ILIKE %s OR name %% %s
+                    ORDER BY rank DESC LIMIT %s)""")
+                params += [q, q, pattern, pattern, q, limit]
+            else:
+                branches.append("""(SELECT id, 1.0 AS rank FROM orders
+                    WHERE name ILIKE %s OR address ILIKE %s
+                    ORDER BY id DESC LIMIT %s)""")
+                params += [pattern, pattern, limit]
+
+        if not branches:
+            return []
+
+        cur.execute(f"""
+            SELECT o.*
+            FROM (
+                SELECT id, max(rank) AS rank
+                FROM ({" UNION ALL ".join(branches)}) matches
+                GROUP BY id
+            ) hits
+            JOIN orders o USING (id)
+            ORDER BY hits.rank DESC, o.id DESC
+            LIMIT %s
+        """, params + [limit])
+        return [Order.from_row(row) for row in cur.fetchall()]
+    finally:
+        conn.close()
+
+
+# recent orders shown under the dashboard KPIs (the live feed prepends to it)
+DASHBOARD_RECENT_ORDERS = 20
+
+
+def load_dashboard_summary():
+    """KPIs from one aggregate query plus the latest orders."""
+    conn = get_db()
+    if not conn:
+        return None
+
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT count(*) AS total_orders,
+                   count(*) FILTER (WHERE status = 'PENDING') AS pending_orders,
+                   count(*) FILTER (WHERE status = 'DELIVERED') AS delivered_orders,
+                   COALESCE(sum(total), 0) AS total_revenue,
+                   COALESCE(sum(total) FILTER (
+                       WHERE created_at >= date_trunc('day', LOCALTIMESTAMP)), 0) AS daily_revenue,
+                   COALESCE(sum(total) FILTER (
+                       WHERE created_at >= date_trunc('month', LOCALTIMESTAMP)), 0) AS monthly_revenue
+            FROM orders
+        """)
+        summary = cur.fetchone()
+
+        cur.execute(
+            "SELECT * FROM orders ORDER BY id DESC LIMIT %s",
+            (DASHBOARD_RECENT_ORDERS,)
+        )
+        recent = [Order.from_row(o) for o in cur.fetchall()]
     finally:
         conn.close()
 
+    return {
+        "total_orders": summary["total_orders"],
+        "pending_orders": summary["pending_orders"],
+        "delivered_orders": summary["delivered_orders"],
+        "total_revenue_paise": to_paise(summary["total_revenue"]),
+        "daily_revenue_paise": to_paise(summary["daily_revenue"]),
+        "monthly_revenue_paise": to_paise(summary["monthly_revenue"]),
+        "recent": recent,
+    }
+
+
+# -----------------------------
+# BACKGROUND JOBS
+# -----------------------------
+@jobs.register("order_status_changed")
+def on_order_status_changed(payload):
+    print("ORDER STATUS:", payload["order_id"], "->", payload["status"])
+    # cancelling or reopening moved units on the stock shards
+    if "CANCELLED" in (payload["status"], payload.get("old_status")):
+        fold_sold_stock()
+
 
 # -----------------------------
 # ADMIN LOGIN / LOGOUT
@@ -126,39 +267,58 @@ def admin_logout():
 @admin.route("/dashboard")
 @admin_required
 def admin_dashboard():
-    orders = load_orders()
+    summary = load_dashboard_summary()
+    if summary is None:
+        return "Database unavailable", 503
 
-    total_orders = len(orders)
-    pending_orders = sum(1 for o in orders if o["status"] == "PENDING")
-    delivered_orders = sum(1 for o in orders if o["status"] == "DELIVERED")
-    total_revenue = sum(float(o["total"]) for o in orders)
+    return render_template(
+        "admin/dashboard.html",
+        total_orders=summary["total_orders"],
+        pending_orders=summary["pending_orders"],
+        delivered_orders=summary["delivered_orders"],
+        total_revenue=rupees(summary["total_revenue_paise"]),
+        daily_revenue=rupees(summary["daily_revenue_paise"]),
+        monthly_revenue=rupees(summary["monthly_revenue_paise"]),
+        summary=summary,
+        orders=summary["recent"],
+        recent_limit=DASHBOARD_RECENT_ORDERS
+    )
 
-    now = datetime.now()
 
-    daily_revenue = sum(
-        float(o["total"])
-        for o in orders
-        if o["created_at"] and o["created_at"].date() == now.date()
-    )
+@admin.route("/orders/summary")
+@admin_required
+def orders_summary():
+    # the live feed re-syncs from this after a reconnect
+    summary = load_dashboard_summary()
+    if summary is None:
+        return jsonify(error="Database unavailable"), 503
+
+    summary["recent"] = [
+        {
+            "id": o.id,
+            "name": o.name,
+            "phone": o.phone,
+            "total_paise": o.total_paise,
+            "status": o.status,
+            "created_at": o.created_at.isoformat() if o.created_at else None,
+        }
+        for o in summary["recent"]
+    ]
+    return jsonify(summary)
 
-    monthly_revenue = sum(
-        float(o["total"])
-        for o in orders
-        if o["created_at"]
-        and o["created_at"].year == now.year
-        and o["created_at"].month == now.month
-    )
 
-    return render_template(
-        "admin/dashboard.html",
-        total_orders=total_orders,
-        pending_orders=pending_orders,
-        delivered_orders=delivered_orders,
-        total_revenue=total_revenue,
-        daily_revenue=daily_revenue,
-        monthly_revenue=monthly_revenue,
-        orders=orders
-    )
+@admin.route("/orders/stream")
+@admin_required
+def orders_stream():
+    stream = open_stream()
+    if stream is None:
+        return "Too many live feeds open", 503, {"Retry-After": "30"}
+
+    return Response(stream, mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        # nginx would otherwise buffer the stream
+        "X-Accel-Buffering": "no",
+    })
 
 
 # -----------------------------
@@ -167,7 +327,18 @@ def admin_dashboard():
 @admin.route("/orders")
 @admin_required
 def admin_orders():
-    return render_template("admin/orders.html", orders=load_orders())
+    q = request.args.get("q", "").strip()
+    if q:
+        orders = search_orders(q)
+    else:
+        orders = load_orders()
+
+    return render_template(
+        "admin/orders.html",
+        orders=orders,
+        q=q,
+        search_limit=ORDER_SEARCH_LIMIT
+    )
 
 
 @admin.route("/order/<int:order_id>")
@@ -189,14 +360,29 @@ def delete_order(order_id):
 
     try:
         cur = conn.cursor()
+        quantities = order_quantities(cur, order_id)
         # delete order items first (foreign key safety)
         cur.execute("DELETE FROM order_items WHERE order_id = %s", (order_id,))
-        cur.execute("DELETE FROM orders WHERE id = %s", (order_id,))
+        cur.execute(
+            "DELETE FROM orders WHERE id = %s RETURNING id, user_id, name, phone, total, status, created_at",
+            (order_id,)
+        )
+        deleted = cur.fetchone()
+        if deleted:
+            # not yet shipped: the units are still on the shelf
+            if deleted["status"] in RESTOCK_ON_DELETE:
+                restock(cur, quantities)
+            mark_order_changed(cur, order_id, deleted["created_at"])
+            notify_order_changed(cur, "deleted", deleted)
 
         conn.commit()
     finally:
         conn.close()
 
+    invalidate_invoice(order_id)
+    if deleted:
+        invalidate_order_history(deleted["user_id"])
+
     return redirect(url_for("admin.admin_orders"))
 
 
@@ -210,15 +396,15 @@ def send_whatsapp_update(order_id):
     message = f"""
 Order Update – AyurShop
 
-Order ID: {order['id']}
-Name: {order['name']}
-Status: {order['status']}
-Total: ₹{order['total']}
+Order ID: {order.id}
+Name: {order.name}
+Status: {order.status}
+Total: ₹{order.total}
 """.strip()
 
     whatsapp_url = (
         "https://wa.me/91"
-        + str(order["phone"])
+        + str(order.phone)
         + "?text="
         + quote(message)
     )
@@ -233,7 +419,42 @@ def view_invoice(order_id):
     if not order:
         return "Invoice not found", 404
 
-    return render_template("admin/invoice.html", order=order)
+    return render_template(
+        "admin/invoice.html",
+        order=order,
+        invoice_html=render_invoice(order)
+    )
+
+
+@admin.route("/invoices")
+@admin_required
+def batch_invoices():
+    ids = request.args.get("ids", "").strip()
+    start = request.args.get("from", "").strip()
+    end = request.args.get("to", "").strip()
+
+    try:
+        if ids:
+            ids = sorted({int(i) for i in ids.split(",") if i.strip()})
+            orders, truncated = load_invoice_orders(ids=ids)
+        elif start and end:
+            start, end = date.fromisoformat(start), date.fromisoformat(end)
+            orders, truncated = load_invoice_orders(start=start, end=end)
+        else:
+            return "Pass ids or from/to dates", 400
+    except ValueError:
+        return "Invalid ids or dates", 400
+
+    if orders is None:
+        return "Database unavailable", 503
+
+    # each invoice is rendered (or pulled from cache) as the page streams
+    return stream_template(
+        "admin/invoices_batch.html",
+        invoices=(render_invoice(o) for o in orders),
+        count=len(orders),
+        truncated=truncated
+    )
 
 
 @admin.route("/orders/update/<int:order_id>", methods=["POST"])
@@ -252,97 +473,92 @@ def update_order_status(order_id):
 
     try:
         cur = conn.cursor()
-        cur.execute(
-            "UPDATE orders SET status = %s WHERE id = %s",
-            (status, order_id)
-        )
+        cur.execute("""
+            UPDATE orders o SET status = %s
+            FROM (SELECT id, status FROM orders WHERE id = %s FOR UPDATE) old
+            WHERE o.id = old.id
+            RETURNING o.id, o.user_id, o.name, o.phone, o.total, o.status, o.created_at,
+                      old.status AS old_status
+        """, (status, order_id))
+        updated = cur.fetchone()
+        if updated:
+            old_status = updated["old_status"]
+            if status == "CANCELLED" and old_status != "CANCELLED":
+                restock(cur, order_quantities(cur, order_id))
+            elif old_status == "CANCELLED" and status != "CANCELLED":
+                if take_stock(cur, order_quantities(cur, order_id)):
+                    conn.rollback()
+                    return "Not enough stock to reopen this order", 400
+            mark_order_changed(cur, order_id, updated["created_at"])
+            notify_order_changed(cur, "status", updated, old_status=updated["old_status"])
+        jobs.enqueue("order_status_changed", {
+            "order_id": order_id,
+            "status": status,
+            "old_status": updated["old_status"] if updated else None,
+        }, conn=conn)
         conn.commit()
         print("STATUS UPDATED IN DB")
     finally:
         conn.close()
 
-    return redirect(url_for("admin.order_detail", order_id=order_id))
-
-
-def load_products():
-    conn = get_db()
-    if not conn:
-        return []
-
-    try:
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM products ORDER BY id DESC")
-        products = cur.fetchall()
-
-        for p in products:
-            # Fix images
-            if isinstance(p.get("images"), str):
-                p["images"] = json.loads(p["images"])
-            elif p.get("images") is None:
-                p["images"] = []
-
-            # Fix badges
-            if isinstance(p.get("badges"), str):
-                p["badges"] = json.loads(p["badges"])
-            elif p.get("badges") is None:
-                p["badges"] = []
+    invalidate_invoice(order_id)
+    if updated:
+        invalidate_order_history(updated["user_id"])
 
-            # Fix text fields (recommended for future compatibility)
-            for field in ["ingredients", "nutrition", "dosage", "additional_info"]:
-                p[field] = p.get(field) or ""
-
-        return products
-
-    finally:
-        conn.close()
+    return redirect(url_for("admin.order_detail", order_id=order_id))
 
 
-def load_product(product_id):
-    conn = get_db()
-    if not conn:
-        return None
+# -----------------------------
+# DISPATCH
+# -----------------------------
+@admin.route("/dispatch")
+@admin_required
+def admin_dispatch():
+    plan = load_dispatch_plan()
+    if plan is None:
+        return "Database unavailable", 503
 
-    try:
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM products WHERE id = %s", (product_id,))
-        product = cur.fetchone()
+    return render_template("admin/dispatch.html", plan=plan)
 
-        if not product:
-            return None
 
-        # Normalize images
-        if isinstance(product.get("images"), str):
-            product["images"] = json.loads(product["images"])
-        else:
-            product["images"] = product.get("images") or []
+# -----------------------------
+# REPORTS
+# -----------------------------
+@admin.route("/reports")
+@admin_required
+def admin_reports():
+    days = request.args.get("days", 30, type=int)
+    if days not in REPORT_RANGES:
+        days = 30
 
-        # Normalize badges
-        if isinstance(product.get("badges"), str):
-            product["badges"] = json.loads(product["badges"])
-        else:
-            product["badges"] = product.get("badges") or []
+    report = load_sales_report(days)
+    if report is None:
+        return "Database unavailable", 503
 
-        # Normalize text fields (MANDATORY)
-        for field in ["ingredients", "nutrition", "dosage", "additional_info"]:
-            product[field] = product.get(field) or ""
+    return render_template(
+        "admin/reports.html",
+        report=report,
+        ranges=REPORT_RANGES
+    )
 
-        return product
 
-    finally:
-        conn.close()
+# -----------------------------
+# PROFILES (?_profile=1 on any request)
+# -----------------------------
+@admin.route("/profiles")
+@admin_required
+def admin_profiles():
+    return render_template("admin/profiles.html", profiles=list_profiles())
 
 
-def get_categories():
-    conn = get_db()
-    if not conn:
-        return []
+@admin.route("/profiles/<name>")
+@admin_required
+def download_profile(name):
+    path = profile_path(name)
+    if not path:
+        return "Profile not found", 404
 
-    try:
-        cur = conn.cursor()
-        cur.execute("SELECT DISTINCT category FROM products WHERE category IS NOT NULL")
-        return sorted([row["category"] for row in cur.fetchall()])
-    finally:
-        conn.close()
+    return send_file(path, mimetype="text/plain", as_attachment=True, download_name=name)
 
 
 # -----------------------------
@@ -351,7 +567,7 @@ def get_categories():
 @admin.route("/products")
 @admin_required
 def admin_products():
-    products = load_products()
+    products = load_admin_product_cards()
     return render_template("admin/products.html", products=products)
 
 
@@ -373,9 +589,7 @@ def add_product():
                     error="Exactly 5 images are required"
                 )
 
-            upload_dir = os.path.join("app", "static", "images")
-            os.makedirs(upload_dir, exist_ok=True)
-
+            storage = get_storage()
             image_names = []
 
             for img in images:
@@ -395,8 +609,12 @@ def add_product():
                         error="Only JPG, JPEG, PNG, and WEBP images are allowed"
                     )
 
-                filename = f"{uuid.uuid4().hex}{ext}"
-                img.save(os.path.join(upload_dir, filename))
+                # size, header and hash were checked while the body was parsed
+                # (SpooledUploadRequest); save only renames the spooled part
+                try:
+                    filename = storage.save(img.stream, ext)
+                except UploadError as e:
+                    return render_template("admin/add_product.html", error=str(e))
                 image_names.append(filename)
 
             # 🔒 FINAL SAFETY CHECK
@@ -412,6 +630,7 @@ def add_product():
                  description, ingredients, nutrition, dosage, additional_info,
                  stock, category, badges, images, created_at)
                 VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
+                RETURNING id
             """, (
                 request.form["name"],
                 request.form["mrp"],
@@ -430,25 +649,44 @@ def add_product():
                 json.dumps(image_names),
                 datetime.now()
             ))
+            product_id = cur.fetchone()["id"]
 
+            ensure_shards(cur, [product_id])
+            refresh_category_facets(cur)
+            notify_catalog_changed(cur, product_id)
             conn.commit()
+            invalidate_product(product_id)
             return redirect(url_for("admin.admin_products"))
 
         finally:
             conn.close()
 
-    return render_template("admin/add_product.html")
+    return render_template(
+        "admin/add_product.html",
+        facets={f["category"]: f for f in load_category_facets()}
+    )
 
 
 
 @admin.route("/products/edit/<int:product_id>", methods=["GET", "POST"])
 @admin_required
 def edit_product(product_id):
-    product = load_product(product_id)
+    # straight from the DB: the cached copy can be a minute old and its
+    # stock doesn't count units sold since the last fold
+    product = load_product_for_edit(product_id)
     if not product:
         return "Product not found", 404
 
     if request.method == "POST":
+        # orders keep selling while the form is open: apply only the
+        # admin's change to the on-hand figure they were shown
+        try:
+            stock_delta = int(request.form["stock"]) - int(
+                request.form.get("stock_shown", request.form["stock"])
+            )
+        except ValueError:
+            return "Invalid stock quantity", 400
+
         conn = get_db()
         try:
             cur = conn.cursor()
@@ -457,7 +695,7 @@ def edit_product(product_id):
             new_images = request.files.getlist("images")
 
             # 🔧 B. Default: keep existing images
-            image_names = product["images"]
+            image_names = product.images
 
             # 🔧 C. If admin uploads images → FORCE exactly 5
             if new_images and new_images[0].filename:
@@ -465,9 +703,7 @@ def edit_product(product_id):
                     return "Exactly 5 images are required", 400
 
                 # 🔧 D. Save new images (replace old ones)
-                upload_dir = os.path.join("app", "static", "images")
-                os.makedirs(upload_dir, exist_ok=True)
-
+                storage = get_storage()
                 image_names = []
 
                 for img in new_images:
@@ -477,8 +713,10 @@ def edit_product(product_id):
                     if ext not in ALLOWED_IMAGE_EXTENSIONS:
                         return "Invalid image type", 400
 
-                    filename = f"{uuid.uuid4().hex}{ext}"
-                    img.save(os.path.join(upload_dir, filename))
+                    try:
+                        filename = storage.save(img.stream, ext)
+                    except UploadError as e:
+                        return str(e), 400
                     image_names.append(filename)
 
             # 4️⃣ UPDATE SQL QUERY (with images column)
@@ -495,7 +733,7 @@ def edit_product(product_id):
                 nutrition=%s,
                 dosage=%s,
                 additional_info=%s,
-                stock=%s,
+                stock=stock + %s,
                 category=%s,
                 badges=%s,
                 images=%s
@@ -512,13 +750,19 @@ def edit_product(product_id):
                 request.form.get("nutrition", ""),
                 request.form.get("dosage", ""),
                 request.form.get("additional_info", ""),
-                request.form["stock"],
+                stock_delta,
                 request.form["category"],
                 json.loads(request.form.get("badges") or "[]"),
                 json.dumps(image_names),
                 product_id
             ))
+            if stock_delta:
+                # re-split what isn't held at checkout
+                rebalance(cur, product_id)
+            refresh_category_facets(cur)
+            notify_catalog_changed(cur, product_id)
             conn.commit()
+            invalidate_product(product_id)
         finally:
             conn.close()
 
@@ -527,7 +771,7 @@ def edit_product(product_id):
     return render_template(
         "admin/edit_product.html",
         product=product,
-        categories=get_categories()
+        categories=load_category_facets()
     )
 
 
@@ -538,7 +782,11 @@ def delete_product(product_id):
     try:
         cur = conn.cursor()
         cur.execute("DELETE FROM products WHERE id=%s", (product_id,))
+        rebalance(cur, product_id)
+        refresh_category_facets(cur)
+        notify_catalog_changed(cur, product_id)
         conn.commit()
+        invalidate_product(product_id)
     finally:
         conn.close()
 
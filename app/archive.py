@@ -0,0 +1,404 @@
+import gzip
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from app import jobs
+from app.config import (
+    ORDER_PARTITIONS_AHEAD,
+    ORDER_RETENTION_MONTHS,
+    ORDER_ARCHIVE_INTERVAL,
+)
+from app.database import get_db, init_db
+from app.models import Order
+
+# only partitions whose orders are all settled are archived
+FINAL_STATUSES = ("DELIVERED", "CANCELLED")
+
+# orders per gzip block row; the archive index points at the block, so a
+# lookup decompresses at most this many lines
+ARCHIVE_BLOCK_ORDERS = 64
+
+# pg_try_advisory_lock key so only one archival pass runs at a time
+ARCHIVE_LOCK_KEY = 0x0A4C_1100
+
+
+# -----------------------------
+# MONTHS / PARTITION NAMES
+# -----------------------------
+def _month_start(d):
+    return date(d.year, d.month, 1)
+
+
+def _add_months(month, n):
+    years, index = divmod(month.month - 1 + n, 12)
+    return date(month.year + years, index + 1, 1)
+
+
+def _partition_name(table, month):
+    return f"{table}_p{month:%Y_%m}"
+
+
+def is_partitioned(cur):
+    cur.execute("""
+        SELECT relkind FROM pg_class WHERE oid = to_regclass('orders')
+    """)
+    row = cur.fetchone()
+    return row is not None and row["relkind"] == "p"
+
+
+def _create_month(cur, month, orders_table="orders", items_table="order_items"):
+    bounds = (month, _add_months(month, 1))
+    cur.execute(
+        f"CREATE TABLE IF NOT EXISTS {_partition_name('orders', month)} "
+        f"PARTITION OF {orders_table} FOR VALUES FROM (%s) TO (%s)",
+        bounds
+    )
+    cur.execute(
+        f"CREATE TABLE IF NOT EXISTS {_partition_name('order_items', month)} "
+        f"PARTITION OF {items_table} FOR VALUES FROM (%s) TO (%s)",
+        bounds
+    )
+
+
+def ensure_partitions(cur):
+    """Create this month's and the next ORDER_PARTITIONS_AHEAD months' partitions."""
+    month = _month_start(date.today())
+    for _ in range(ORDER_PARTITIONS_AHEAD + 1):
+        cur.execute("SAVEPOINT partition_month")
+        try:
+            _create_month(cur, month)
+            cur.execute("RELEASE SAVEPOINT partition_month")
+        except Exception as e:
+            # rows for that month already landed in the default partition
+            print("ORDER PARTITION NOT CREATED:", month, e)
+            cur.execute("ROLLBACK TO SAVEPOINT partition_month")
+        month = _add_months(month, 1)
+
+
+# -----------------------------
+# MIGRATION (flask partition-orders)
+# -----------------------------
+def partition_orders():
+    """Rebuild orders/order_items as tables range-partitioned by month.
+
+    Runs in one transaction under an exclusive lock: the copy either fully
+    replaces the old tables or nothing changes. Returns False if the
+    tables are already partitioned.
+    """
+    conn = get_db()
+    if not conn:
+        raise RuntimeError("Database unavailable")
+
+    try:
+        cur = conn.cursor()
+        if is_partitioned(cur):
+            return False
+
+        cur.execute("LOCK TABLE orders, order_items IN ACCESS EXCLUSIVE MODE")
+
+        # the partition key is part of the primary key, so it can't be NULL;
+        # undated legacy rows are filed with the oldest order
+        cur.execute("SELECT min(created_at) AS first FROM orders")
+        first = cur.fetchone()["first"] or datetime.now()
+        cur.execute("UPDATE orders SET created_at = %s WHERE created_at IS NULL", (first,))
+        cur.execute("""
+            UPDATE order_items i SET order_created_at = o.created_at
+            FROM orders o
+            WHERE i.order_id = o.id AND i.order_created_at IS NULL
+        """)
+        cur.execute(
+            "UPDATE order_items SET order_created_at = %s WHERE order_created_at IS NULL",
+            (first,)
+        )
+
+        cur.execute("""
+            CREATE TABLE orders_partitioned
+                (LIKE orders INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+                PARTITION BY RANGE (created_at)
+        """)
+        cur.execute("""
+            ALTER TABLE orders_partitioned
+                ALTER COLUMN created_at SET NOT NULL,
+                ADD PRIMARY KEY (id, created_at)
+        """)
+        cur.execute("""
+            ALTER TABLE orders_partitioned
+                ADD FOREIGN KEY (user_id) REFERENCES users(id)
+        """)
+        cur.execute("""
+            CREATE TABLE order_items_partitioned
+                (LIKE order_items INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+                PARTITION BY RANGE (order_created_at)
+        """)
+        cur.execute("""
+            ALTER TABLE order_items_partitioned
+                ALTER COLUMN order_created_at SET NOT NULL,
+                ADD PRIMARY KEY (id, order_created_at)
+        """)
+
+        month = _month_start(first)
+        last = _add_months(_month_start(date.today()), ORDER_PARTITIONS_AHEAD)
+        while month <= last:
+            _create_month(cur, month, "orders_partitioned", "order_items_partitioned")
+            month = _add_months(month, 1)
+
+        # anything outside the monthly ranges (clock skew, far-future dates)
+        cur.execute("CREATE TABLE orders_default PARTITION OF orders_partitioned DEFAULT")
+        cur.execute("CREATE TABLE order_items_default PARTITION OF order_items_partitioned DEFAULT")
+
+        cur.execute("INSERT INTO orders_partitioned SELECT * FROM orders")
+        copied_orders = cur.rowcount
+        cur.execute("INSERT INTO order_items_partitioned SELECT * FROM order_items")
+        copied_items = cur.rowcount
+
+        # keep the id sequences alive when the old tables are dropped
+        for table in ("orders", "order_items"):
+            cur.execute("SELECT pg_get_serial_sequence(%s, 'id') AS seq", (table,))
+            seq = cur.fetchone()["seq"]
+            if seq:
+                cur.execute(f"ALTER SEQUENCE {seq} OWNED BY {table}_partitioned.id")
+
+        cur.execute("DROP TABLE order_items")
+        cur.execute("DROP TABLE orders")
+        cur.execute("ALTER TABLE orders_partitioned RENAME TO orders")
+        cur.execute("ALTER TABLE order_items_partitioned RENAME TO order_items")
+        cur.execute("ALTER TABLE orders RENAME CONSTRAINT orders_partitioned_pkey TO orders_pkey")
+        cur.execute(
+            "ALTER TABLE order_items RENAME CONSTRAINT order_items_partitioned_pkey TO order_items_pkey"
+        )
+
+        conn.commit()
+        print(f"ORDERS PARTITIONED: {copied_orders} orders, {copied_items} items")
+    finally:
+        conn.close()
+
+    # recreate the secondary indexes on the new partitioned tables
+    init_db()
+    return True
+
+
+# -----------------------------
+# ARCHIVAL
+# -----------------------------
+def _archivable_months(cur, cutoff):
+    cur.execute("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'orders'::regclass
+          AND c.relname ~ '^orders_p[0-9]{4}_[0-9]{2}$'
+        ORDER BY c.relname
+    """)
+    for row in cur.fetchall():
+        year, month = row["relname"][len("orders_p"):].split("_")
+        start = date(int(year), int(month), 1)
+        if _add_months(start, 1) <= cutoff:
+            yield start
+
+
+def _write_archive(conn, month):
+    """Copy one month of orders with their items into gzip JSONL blocks.
+
+    The blocks go to order_archive_blocks in the caller's transaction, so
+    they commit together with the partition drop or not at all.
+    """
+    orders_part = _partition_name("orders", month)
+    items_part = _partition_name("order_items", month)
+    out = conn.cursor()
+    index = []
+    block = []
+
+    def flush():
+        if block:
+            data = gzip.compress("".join(line for line, _ in block).encode())
+            out.execute(
+                "INSERT INTO order_archive_blocks (month, orders, data) "
+                "VALUES (%s, %s, %s) RETURNING id",
+                (month, len(block), psycopg2.Binary(data))
+            )
+            block_id = out.fetchone()["id"]
+            index.extend(row + (block_id,) for _, row in block)
+            block.clear()
+
+    cur = conn.cursor(name=f"archive_{month:%Y_%m}")
+    cur.itersize = 500
+    cur.execute(f"""
+        SELECT row_to_json(o)::text AS order_json,
+               (SELECT COALESCE(json_agg(i ORDER BY i.id), '[]')::text
+                FROM {items_part} i WHERE i.order_id = o.id) AS items_json
+        FROM {orders_part} o
+        ORDER BY o.id
+    """)
+
+    for row in cur:
+        order = json.loads(row["order_json"], parse_float=Decimal)
+        block.append((
+            f'{{"order": {row["order_json"]}, "items": {row["items_json"]}}}\n',
+            (order["id"], order["user_id"], order["created_at"],
+             order["total"], order["status"]),
+        ))
+        if len(block) >= ARCHIVE_BLOCK_ORDERS:
+            flush()
+    flush()
+    cur.close()
+
+    return index
+
+
+def archive_old_orders(dry_run=False):
+    """Move month partitions older than ORDER_RETENTION_MONTHS into order_archive.
+
+    Archived months stay in Postgres as compressed blocks: the app's disk
+    is per-process scratch space (ephemeral on Heroku), not storage.
+    """
+    report = {"dry_run": dry_run, "locked": False, "archived": [], "skipped": [], "orders": 0}
+    cutoff = _add_months(_month_start(date.today()), -ORDER_RETENTION_MONTHS)
+
+    conn = get_db()
+    if not conn:
+        raise RuntimeError("Database unavailable")
+
+    try:
+        cur = conn.cursor()
+        if not is_partitioned(cur):
+            conn.commit()
+            return report
+
+        cur.execute("SELECT pg_try_advisory_lock(%s) AS ok", (ARCHIVE_LOCK_KEY,))
+        if not cur.fetchone()["ok"]:
+            report["locked"] = True
+            return report
+
+        try:
+            ensure_partitions(cur)
+            months = list(_archivable_months(cur, cutoff))
+            conn.commit()
+
+            for month in months:
+                orders_part = _partition_name("orders", month)
+                items_part = _partition_name("order_items", month)
+
+                # block writes to the month while it is copied out
+                cur.execute(f"LOCK TABLE {orders_part}, {items_part} IN SHARE MODE")
+                cur.execute(
+                    f"SELECT count(*) AS orders, "
+                    f"count(*) FILTER (WHERE status NOT IN %s) AS open "
+                    f"FROM {orders_part}",
+                    (FINAL_STATUSES,)
+                )
+                counts = cur.fetchone()
+                if counts["open"]:
+                    report["skipped"].append((month, counts["open"]))
+                    conn.rollback()
+                    continue
+
+                if dry_run:
+                    report["archived"].append((month, counts["orders"]))
+                    report["orders"] += counts["orders"]
+                    conn.rollback()
+                    continue
+
+                index = _write_archive(conn, month)
+
+                execute_values(cur, """
+                    INSERT INTO order_archive
+                        (order_id, user_id, created_at, total, status, block_id)
+                    VALUES %s
+                    ON CONFLICT (order_id) DO NOTHING
+                """, index, page_size=1000)
+
+                # every order of the month must be indexed before it is dropped
+                cur.execute(f"""
+                    SELECT count(*) AS indexed
+                    FROM {orders_part} o
+                    JOIN order_archive a ON a.order_id = o.id
+                    JOIN order_archive_blocks b ON b.id = a.block_id
+                """)
+                indexed = cur.fetchone()["indexed"]
+                if indexed != counts["orders"] or len(index) != counts["orders"]:
+                    raise RuntimeError(
+                        f"archive of {month:%Y-%m} incomplete: "
+                        f"{indexed}/{counts['orders']} orders indexed"
+                    )
+
+                cur.execute(f"ALTER TABLE order_items DETACH PARTITION {items_part}")
+                cur.execute(f"ALTER TABLE orders DETACH PARTITION {orders_part}")
+                cur.execute(f"DROP TABLE {items_part}")
+                cur.execute(f"DROP TABLE {orders_part}")
+                conn.commit()
+
+                report["archived"].append((month, len(index)))
+                report["orders"] += len(index)
+        finally:
+            conn.rollback()
+            cur.execute("SELECT pg_advisory_unlock(%s)", (ARCHIVE_LOCK_KEY,))
+            conn.commit()
+    finally:
+        conn.close()
+
+    return report
+
+
+def print_archive_report(report):
+    if report["locked"]:
+        print("ORDER ARCHIVE: another run is in progress, skipped")
+        return
+
+    action = "would archive" if report["dry_run"] else "archived"
+    for month, orders in report["archived"]:
+        print(f"ORDER ARCHIVE: {action} {month:%Y-%m} ({orders} orders)")
+    for month, open_orders in report["skipped"]:
+        print(f"ORDER ARCHIVE: kept {month:%Y-%m}, {open_orders} order(s) not delivered/cancelled")
+    if not report["archived"] and not report["skipped"]:
+        print("ORDER ARCHIVE: nothing older than", ORDER_RETENTION_MONTHS, "months")
+
+
+@jobs.register("archive_orders")
+def archive_orders_job(payload):
+    print_archive_report(archive_old_orders(dry_run=payload.get("dry_run", False)))
+
+
+jobs.every(ORDER_ARCHIVE_INTERVAL, "archive_orders")
+
+
+# -----------------------------
+# READ SIDE
+# -----------------------------
+def _order_from_record(record):
+    order = record["order"]
+    if order.get("created_at"):
+        order["created_at"] = datetime.fromisoformat(order["created_at"])
+    return Order.from_row(order, record["items"])
+
+
+def load_archived_order(order_id, cur=None):
+    """An archived Order with its items, or None."""
+    if cur is None:
+        conn = get_db()
+        if not conn:
+            return None
+        try:
+            return load_archived_order(order_id, conn.cursor())
+        finally:
+            conn.close()
+
+    cur.execute("""
+        SELECT b.data
+        FROM order_archive a
+        JOIN order_archive_blocks b ON b.id = a.block_id
+        WHERE a.order_id = %s
+    """, (order_id,))
+    entry = cur.fetchone()
+    if not entry:
+        return None
+
+    for line in gzip.decompress(bytes(entry["data"])).splitlines():
+        record = json.loads(line, parse_float=Decimal)
+        if record["order"]["id"] == order_id:
+            return _order_from_record(record)
+
+    return None
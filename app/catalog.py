@@ -0,0 +1,356 @@
+import fcntl
+import json
+import os
+import threading
+from datetime import date, datetime
+from decimal import Decimal
+
+from app.cache import TTLCache
+from app.config import (
+    CATALOG_CACHE_TTL,
+    CATALOG_VERSION_CHECK,
+    CATALOG_SNAPSHOT_PATH,
+    CATALOG_SNAPSHOT_FLUSH_INTERVAL,
+)
+from app.database import get_db
+from app.models import Product
+from app import listener
+
+
+# -----------------------------
+# PROJECTIONS
+# -----------------------------
+# Listing pages only need what a product card shows; the TEXT blobs and the
+# full image list are loaded on product_detail / edit_product only.
+CARD_COLUMNS = """
+    id, name, price, mrp, rating, rating_count, delivery_days,
+    stock, category, badges,
+    COALESCE(images->>0, 'default.png') AS image
+"""
+
+product_cache = TTLCache(ttl=CATALOG_CACHE_TTL, maxsize=512)
+
+# pg_advisory_xact_lock key serialising category_facets rebuilds
+FACETS_LOCK_KEY = 0x5A1E_3000
+
+
+# -----------------------------
+# LAST KNOWN-GOOD SNAPSHOT
+# -----------------------------
+# Served while the DB circuit is open; persisted so a restarted worker can
+# still render the catalog during an outage. Requests only update memory;
+# changed entries are merged into the shared file off the request path.
+# "dirty" holds (section, key) pairs changed since the last flush.
+_snapshot = {"data": None, "dirty": set()}
+_snapshot_lock = threading.Lock()
+
+
+def _json_default(value):
+    if isinstance(value, Product):
+        return value.to_dict()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialise {type(value).__name__}")
+
+
+def _snapshot_data():
+    if _snapshot["data"] is None:
+        data = {"cards": None, "facets": None, "products": {}}
+        try:
+            with open(CATALOG_SNAPSHOT_PATH, "r", encoding="utf-8") as f:
+                data.update(json.load(f))
+        except (OSError, ValueError):
+            pass
+        _snapshot["data"] = data
+    return _snapshot["data"]
+
+
+def _remember(section, value, key=None):
+    # store plain dicts so the in-memory and on-disk forms match
+    value = json.loads(json.dumps(value, default=_json_default))
+    key = None if key is None else str(key)
+
+    with _snapshot_lock:
+        data = _snapshot_data()
+        current = data[section] if key is None else data[section].get(key)
+        if current == value:
+            return
+        if key is None:
+            data[section] = value
+        else:
+            data[section][key] = value
+        _snapshot["dirty"].add((section, key))
+
+
+def flush_snapshot(conn=None):
+    """Merge this worker's changed entries into the snapshot file.
+
+    Runs from the listener thread (``conn`` is unused). Entries other
+    workers wrote are kept; the file lock stops two merges interleaving.
+    """
+    with _snapshot_lock:
+        dirty, _snapshot["dirty"] = _snapshot["dirty"], set()
+        data = _snapshot["data"]
+        changes = [
+            (section, key, data[section] if key is None else data[section][key])
+            for section, key in dirty
+        ]
+    if not changes:
+        return
+
+    try:
+        with open(f"{CATALOG_SNAPSHOT_PATH}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            on_disk = {"cards": None, "facets": None, "products": {}}
+            try:
+                with open(CATALOG_SNAPSHOT_PATH, "r", encoding="utf-8") as f:
+                    on_disk.update(json.load(f))
+            except (OSError, ValueError):
+                pass
+
+            for section, key, value in changes:
+                if key is None:
+                    on_disk[section] = value
+                else:
+                    on_disk[section][key] = value
+
+            tmp = f"{CATALOG_SNAPSHOT_PATH}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(on_disk, f)
+            os.replace(tmp, CATALOG_SNAPSHOT_PATH)
+    except OSError as e:
+        print("CATALOG SNAPSHOT WRITE FAILED:", e)
+        with _snapshot_lock:
+            _snapshot["dirty"].update((section, key) for section, key, _ in changes)
+
+
+def _snapshot_cards(category=None):
+    cards = [Product.from_dict(p) for p in _snapshot_data()["cards"] or []]
+    if category:
+        return [p for p in cards if p.category == category]
+    return cards
+
+
+def _snapshot_product(product_id):
+    data = _snapshot_data()["products"].get(str(product_id))
+    return Product.from_dict(data) if data else None
+
+
+# -----------------------------
+# LOADERS
+# -----------------------------
+def load_product_cards(category=None):
+    key = f"cards:{category}" if category else "cards"
+    cards = product_cache.get(key)
+    if cards is not None:
+        return cards
+
+    conn = get_db()
+    if not conn:
+        return _snapshot_cards(category)
+
+    try:
+        cur = conn.cursor()
+        if category:
+            # served by idx_products_category
+            cur.execute(
+                f"SELECT {CARD_COLUMNS} FROM products WHERE category = %s ORDER BY id DESC",
+                (category,)
+            )
+        else:
+            cur.execute(f"SELECT {CARD_COLUMNS} FROM products ORDER BY id DESC")
+        cards = [Product.from_row(p) for p in cur.fetchall()]
+    finally:
+        conn.close()
+
+    product_cache.set(key, cards)
+    if not category:
+        product_cache.set("cards_by_id", {p.id: p for p in cards})
+        _remember("cards", cards)
+    return cards
+
+
+def get_product_card(product_id):
+    by_id = product_cache.get("cards_by_id")
+    if by_id is None:
+        cards = load_product_cards()
+        by_id = product_cache.get("cards_by_id") or {p.id: p for p in cards}
+    return by_id.get(product_id)
+
+
+def load_admin_product_cards():
+    # admin list shows every thumbnail, so keep the (small) images array
+    conn = get_db()
+    if not conn:
+        return []
+
+    try:
+        cur = conn.cursor()
+        cur.execute(f"SELECT {CARD_COLUMNS}, images FROM products ORDER BY id DESC")
+        return [Product.from_row(p) for p in cur.fetchall()]
+    finally:
+        conn.close()
+
+
+def load_product(product_id):
+    key = f"product:{product_id}"
+    product = product_cache.get(key)
+    if product is not None:
+        return product
+
+    conn = get_db()
+    if not conn:
+        return _snapshot_product(product_id)
+
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT * FROM products WHERE id = %s", (product_id,))
+        product = cur.fetchone()
+    finally:
+        conn.close()
+
+    if not product:
+        return None
+
+    product = Product.from_row(product)
+    product_cache.set(key, product)
+    _remember("products", product, key=product_id)
+    return product
+
+
+def load_product_for_edit(product_id):
+    """Uncached product for the admin edit form; ``stock`` is net of unfolded sales."""
+    conn = get_db()
+    if not conn:
+        return None
+
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT p.*, a.stock AS on_hand
+            FROM products p
+            LEFT JOIN product_availability a ON a.product_id = p.id
+            WHERE p.id = %s
+        """, (product_id,))
+        row = cur.fetchone()
+    finally:
+        conn.close()
+
+    if not row:
+        return None
+
+    row = dict(row)
+    on_hand = row.pop("on_hand")
+    if on_hand is not None:
+        row["stock"] = on_hand
+    return Product.from_row(row)
+
+
+# -----------------------------
+# CATEGORY FACETS
+# -----------------------------
+def refresh_category_facets(cur):
+    """Rebuild category_facets inside the caller's product write transaction."""
+    # concurrent rebuilds would both insert the same new categories; take
+    # turns until the caller commits
+    cur.execute("SELECT pg_advisory_xact_lock(%s)", (FACETS_LOCK_KEY,))
+    cur.execute("""
+        INSERT INTO category_facets
+            (category, products, in_stock, min_price, max_price, updated_at)
+        SELECT category,
+               count(*),
+               count(*) FILTER (WHERE stock > 0),
+               min(price),
+               max(price),
+               now()
+        FROM products
+        WHERE category IS NOT NULL AND category <> ''
+        GROUP BY category
+        ON CONFLICT (category) DO UPDATE SET
+            products = EXCLUDED.products,
+            in_stock = EXCLUDED.in_stock,
+            min_price = EXCLUDED.min_price,
+            max_price = EXCLUDED.max_price,
+            updated_at = EXCLUDED.updated_at
+    """)
+    # categories whose last product was deleted or moved
+    cur.execute("""
+        DELETE FROM category_facets f
+        WHERE NOT EXISTS (SELECT 1 FROM products p WHERE p.category = f.category)
+    """)
+
+
+def load_category_facets():
+    facets = product_cache.get("facets")
+    if facets is not None:
+        return facets
+
+    conn = get_db()
+    if not conn:
+        return _snapshot_data()["facets"] or []
+
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT category, products, in_stock, min_price, max_price
+            FROM category_facets
+            ORDER BY category
+        """)
+        facets = cur.fetchall()
+    finally:
+        conn.close()
+
+    product_cache.set("facets", facets)
+    _remember("facets", facets)
+    return facets
+
+
+# -----------------------------
+# INVALIDATION (this worker + every other worker via NOTIFY)
+# -----------------------------
+# last catalog_meta.version this worker has caught up with
+_seen = {"version": None}
+
+
+def invalidate_product(product_id=None):
+    product_cache.pop_where(lambda k: k.startswith("cards") or k == "facets")
+    if product_id is not None:
+        product_cache.pop(f"product:{product_id}")
+
+
+def notify_catalog_changed(cur, product_id=None):
+    """Bump the catalog version and NOTIFY other workers, in the caller's transaction."""
+    cur.execute("UPDATE catalog_meta SET version = version + 1 WHERE id = 1 RETURNING version")
+    row = cur.fetchone()
+    listener.notify(cur, "catalog_changed", {
+        "product_id": product_id,
+        "version": row["version"] if row else None,
+    })
+
+
+def _on_catalog_changed(payload):
+    invalidate_product(payload.get("product_id"))
+    if payload.get("version") is not None:
+        _seen["version"] = max(_seen["version"] or 0, payload["version"])
+
+
+def _check_catalog_version(conn):
+    # fallback for notifications missed while the listener was reconnecting
+    cur = conn.cursor()
+    cur.execute("SELECT version FROM catalog_meta WHERE id = 1")
+    row = cur.fetchone()
+    version = row[0] if row else None
+
+    if version != _seen["version"]:
+        if _seen["version"] is not None:
+            print("CATALOG VERSION CHANGED, dropping cache:", _seen["version"], "->", version)
+            product_cache.clear()
+        _seen["version"] = version
+
+
+listener.subscribe("catalog_changed", _on_catalog_changed)
+listener.every(CATALOG_VERSION_CHECK, _check_catalog_version)
+listener.every(CATALOG_SNAPSHOT_FLUSH_INTERVAL, flush_snapshot)
@@ -0,0 +1,69 @@
+import click
+
+from app import jobs
+from app.image_gc import collect_orphaned_images, print_report
+from app.reports import refresh_sales_reports
+from app.recommendations import refresh_recommendations
+from app.archive import partition_orders, archive_old_orders, print_archive_report
+
+
+def register_commands(app):
+
+    @app.cli.command("worker")
+    @click.option("--burst", is_flag=True, help="Exit once the queue is empty.")
+    def worker(burst):
+        """Run the background job worker."""
+        jobs.run_worker(burst=burst)
+
+    @app.cli.command("jobs")
+    def jobs_status():
+        """Show queue depth and timing per job."""
+        rows = jobs.job_summary()
+        if not rows:
+            click.echo("No jobs")
+            return
+
+        for r in rows:
+            click.echo(
+                f"{r['name']:<28} {r['status']:<8} {r['jobs']:>7} "
+                f"avg={r['avg_ms'] or 0}ms max={r['max_ms'] or 0}ms"
+            )
+
+    @app.cli.command("gc-images")
+    @click.option("--dry-run", is_flag=True, help="Report orphans without deleting.")
+    @click.option("--grace-hours", type=float, default=None,
+                  help="Only sweep files older than this (default IMAGE_GC_GRACE_HOURS).")
+    def gc_images(dry_run, grace_hours):
+        """Delete image files no product references."""
+        print_report(collect_orphaned_images(dry_run=dry_run, grace_hours=grace_hours))
+
+    @app.cli.command("refresh-reports")
+    def refresh_reports():
+        """Rebuild sales report rows for days with new or changed orders."""
+        days = refresh_sales_reports()
+        if days is None:
+            click.echo("Another refresh is running")
+        else:
+            click.echo(f"Refreshed {days} day(s)")
+
+    @app.cli.command("refresh-recommendations")
+    @click.option("--full", is_flag=True, help="Recount every live order from scratch.")
+    def refresh_recommendations_command(full):
+        """Fold new orders into the "frequently bought together" lists."""
+        counted = refresh_recommendations(full=full)
+        if counted is None:
+            click.echo("Another refresh is running")
+        else:
+            click.echo(f"Counted {counted} order(s)")
+
+    @app.cli.command("partition-orders")
+    def partition_orders_command():
+        """Convert orders/order_items to monthly range partitions."""
+        if not partition_orders():
+            click.echo("orders is already partitioned")
+
+    @app.cli.command("archive-orders")
+    @click.option("--dry-run", is_flag=True, help="List the months that would be archived.")
+    def archive_orders_command(dry_run):
+        """Archive settled order partitions older than ORDER_RETENTION_MONTHS."""
+        print_archive_report(archive_old_orders(dry_run=dry_run))
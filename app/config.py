@@ -20,4 +20,134 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg", "webp"}
 
+# Product image uploads (content-addressed, see app/storage.py)
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "local")
+MAX_IMAGE_BYTES = int(os.environ.get("MAX_IMAGE_BYTES", str(5 * 1024 * 1024)))
+MAX_IMAGE_DIMENSION = int(os.environ.get("MAX_IMAGE_DIMENSION", "4096"))
+# Orphaned image sweep (flask gc-images / gc_images job)
+IMAGE_GC_GRACE_HOURS = float(os.environ.get("IMAGE_GC_GRACE_HOURS", "24"))
+IMAGE_GC_INTERVAL = int(os.environ.get("IMAGE_GC_INTERVAL", str(6 * 3600)))
+# Sales report summary tables (flask refresh-reports / refresh_sales_reports job)
+REPORTS_REFRESH_INTERVAL = int(os.environ.get("REPORTS_REFRESH_INTERVAL", "60"))
+# 5 images plus the text fields of the product form
+MAX_CONTENT_LENGTH = 5 * MAX_IMAGE_BYTES + 1024 * 1024
+
 PRODUCTS_FILE = os.path.join(DATA_DIR, "products.json")
+
+# Returning-user lookups at /login (seconds)
+USER_CACHE_TTL = int(os.environ.get("USER_CACHE_TTL", "300"))
+
+# Per-worker customer order history (/account/orders), dropped on order
+# writes; the TTL only bounds staleness if a NOTIFY is missed (seconds)
+ORDER_HISTORY_CACHE_TTL = int(os.environ.get("ORDER_HISTORY_CACHE_TTL", "600"))
+
+# Admin order search (/admin/orders?q=): max rows returned
+ORDER_SEARCH_LIMIT = int(os.environ.get("ORDER_SEARCH_LIMIT", "50"))
+
+# Admission control: "memory" (per worker) or "postgres" (shared by all nodes)
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "1") == "1"
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_PRUNE_INTERVAL = int(os.environ.get("RATE_LIMIT_PRUNE_INTERVAL", "3600"))
+# The DB cap is per worker, like gunicorn's request threads. At or above
+# GUNICORN_THREADS it can never trip (the threads run out first), so the
+# default keeps two threads free to answer non-DB requests and 503s.
+GUNICORN_THREADS = int(os.environ.get("GUNICORN_THREADS", "8"))
+DB_CONCURRENCY_LIMIT = int(os.environ.get(
+    "DB_CONCURRENCY_LIMIT",
+    str(max(GUNICORN_THREADS - 2, 1))
+))
+# Proxies in front of the app that append to X-Forwarded-For (Heroku's
+# router is one). Only that many right-most hops are trusted; anything the
+# client put further left is ignored.
+TRUSTED_PROXY_HOPS = int(os.environ.get("TRUSTED_PROXY_HOPS", "1"))
+
+# Monthly order partitions (flask partition-orders) and cold-order archival.
+# Partitions entirely older than the retention window whose orders are all
+# DELIVERED/CANCELLED are compressed into order_archive_blocks and dropped.
+ORDER_PARTITIONS_AHEAD = int(os.environ.get("ORDER_PARTITIONS_AHEAD", "3"))
+ORDER_RETENTION_MONTHS = int(os.environ.get("ORDER_RETENTION_MONTHS", "24"))
+ORDER_ARCHIVE_INTERVAL = int(os.environ.get("ORDER_ARCHIVE_INTERVAL", str(24 * 3600)))
+
+# Checkout stock holds (app/stock.py): seconds a checkout reserves its
+# cart, counter rows per product, how often expired holds are swept, and
+# how often units sold on the shards are folded into products.stock
+STOCK_HOLD_TTL = int(os.environ.get("STOCK_HOLD_TTL", "600"))
+STOCK_HOLD_SHARDS = int(os.environ.get("STOCK_HOLD_SHARDS", "8"))
+STOCK_HOLD_SWEEP_INTERVAL = int(os.environ.get("STOCK_HOLD_SWEEP_INTERVAL", "60"))
+STOCK_FOLD_INTERVAL = int(os.environ.get("STOCK_FOLD_INTERVAL", "15"))
+
+# "Frequently bought together" (app/recommendations.py): neighbours kept
+# per product, orders a pair must share, and how often new orders are folded in
+RECOMMENDATIONS_TOP_K = int(os.environ.get("RECOMMENDATIONS_TOP_K", "8"))
+RECOMMENDATIONS_MIN_SUPPORT = int(os.environ.get("RECOMMENDATIONS_MIN_SUPPORT", "2"))
+RECOMMENDATIONS_REFRESH_INTERVAL = int(os.environ.get("RECOMMENDATIONS_REFRESH_INTERVAL", "300"))
+
+# Dispatch planner (/admin/dispatch). Google Maps direction links take at
+# most 9 waypoints plus the destination, hence the 10-stop cap.
+DISPATCH_BATCH_SIZE = min(int(os.environ.get("DISPATCH_BATCH_SIZE", "10")), 10)
+DISPATCH_RADIUS_KM = float(os.environ.get("DISPATCH_RADIUS_KM", "3"))
+# Store/warehouse the riders leave from, "lat,lng"; optional
+DISPATCH_DEPOT = os.environ.get("DISPATCH_DEPOT", "")
+
+# Live admin order feed (/admin/orders/stream, Server-Sent Events).
+# Each open stream holds a gunicorn thread, so keep this below the
+# threads per worker and end streams periodically (browsers reconnect).
+ORDER_FEED_MAX_CLIENTS = int(os.environ.get("ORDER_FEED_MAX_CLIENTS", "4"))
+ORDER_FEED_MAX_SECONDS = int(os.environ.get("ORDER_FEED_MAX_SECONDS", "300"))
+ORDER_FEED_HEARTBEAT = int(os.environ.get("ORDER_FEED_HEARTBEAT", "15"))
+
+# Per-request sampling profiler for admins (?_profile=1 or X-Profile: 1).
+# Collapsed-stack files land in PROFILE_DIR, newest PROFILE_KEEP kept.
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "1") == "1"
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join(DATA_DIR, "profiles"))
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", "0.005"))
+PROFILE_MAX_SECONDS = float(os.environ.get("PROFILE_MAX_SECONDS", "30"))
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", "50"))
+
+# Background jobs (flask worker). A handler running longer than
+# JOB_TIMEOUT fails its attempt; a job still marked running after
+# JOB_LOCK_TIMEOUT lost its worker. Keep JOB_TIMEOUT below JOB_LOCK_TIMEOUT
+# so a live job is never mistaken for a lost one.
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "5"))
+JOB_BACKOFF_SECONDS = float(os.environ.get("JOB_BACKOFF_SECONDS", "5"))
+JOB_TIMEOUT = int(os.environ.get("JOB_TIMEOUT", "240"))
+JOB_LOCK_TIMEOUT = int(os.environ.get("JOB_LOCK_TIMEOUT", "300"))
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", "1"))
+# finished job rows are kept this long for `flask jobs`, then deleted
+JOB_DONE_RETENTION_DAYS = int(os.environ.get("JOB_DONE_RETENTION_DAYS", "2"))
+JOB_DEAD_RETENTION_DAYS = int(os.environ.get("JOB_DEAD_RETENTION_DAYS", "30"))
+
+# Per-worker product card / detail cache (seconds)
+CATALOG_CACHE_TTL = int(os.environ.get("CATALOG_CACHE_TTL", "60"))
+
+# Fallback poll of catalog_meta.version when LISTEN/NOTIFY is missed (seconds)
+CATALOG_VERSION_CHECK = int(os.environ.get("CATALOG_VERSION_CHECK", "30"))
+
+# Last known-good catalog, served while Postgres is unreachable
+CATALOG_SNAPSHOT_PATH = os.environ.get(
+    "CATALOG_SNAPSHOT_PATH",
+    os.path.join(DATA_DIR, "catalog_snapshot.json")
+)
+# changed entries are merged into the file from the listener thread
+CATALOG_SNAPSHOT_FLUSH_INTERVAL = int(os.environ.get("CATALOG_SNAPSHOT_FLUSH_INTERVAL", "30"))
+
+# Precompile templates and warm caches inside create_app()
+WARMUP_ON_STARTUP = os.environ.get("WARMUP_ON_STARTUP", "1") == "1"
+JINJA_CACHE_DIR = os.environ.get(
+    "JINJA_CACHE_DIR",
+    os.path.join(DATA_DIR, "jinja_cache")
+)
+
+# Static files: "direct" (sendfile + in-memory small assets), "x-accel"
+# (nginx X-Accel-Redirect) or "x-sendfile" (Apache / lighttpd)
+STATIC_SERVE_MODE = os.environ.get("STATIC_SERVE_MODE", "direct")
+STATIC_ACCEL_PREFIX = os.environ.get("STATIC_ACCEL_PREFIX", "/_static/")
+UPLOADS_ACCEL_PREFIX = os.environ.get("UPLOADS_ACCEL_PREFIX", "/_uploads/")
+STATIC_MAX_AGE = int(os.environ.get("STATIC_MAX_AGE", "3600"))
+STATIC_SMALL_ASSET_MAX = int(os.environ.get("STATIC_SMALL_ASSET_MAX", str(256 * 1024)))
+STATIC_MEMORY_CACHE_MAX = int(os.environ.get("STATIC_MEMORY_CACHE_MAX", str(32 * 1024 * 1024)))
+# held in memory whatever their size
+STATIC_HOT_ASSETS = set(os.environ.get(
+    "STATIC_HOT_ASSETS",
+    "images/logo.png,images/HeroImage.webp,images/default.png"
+).split(","))
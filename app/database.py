@@ -1,24 +1,129 @@
 import os
+import random
+import threading
+import time
 import psycopg2
-from psycopg2.extras import RealDictCursor
 from datetime import datetime
 
+from app.profiler import cursor_factory
+
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "3"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("DB_BREAKER_FAILURES", "3"))
+BREAKER_COOLDOWN = float(os.getenv("DB_BREAKER_COOLDOWN", "5"))
+BREAKER_MAX_COOLDOWN = float(os.getenv("DB_BREAKER_MAX_COOLDOWN", "60"))
+
+
+# -----------------------------
+# CIRCUIT BREAKER
+# -----------------------------
+class CircuitBreaker:
+    """closed -> open after repeated connect failures; open -> half-open after a
+    jittered cool-down, where a single probe decides whether to close again."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.state = "closed"
+        self.failures = 0
+        self.cooldown = BREAKER_COOLDOWN
+        self.retry_at = 0.0
+        self.probing = False
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+
+            if self.state == "open" and time.monotonic() >= self.retry_at:
+                self.state = "half_open"
+
+            if self.state == "half_open" and not self.probing:
+                self.probing = True
+                return True
+
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                print("DB CIRCUIT CLOSED")
+            self.reset()
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.probing = False
+
+            if self.state == "half_open":
+                self.cooldown = min(self.cooldown * 2, BREAKER_MAX_COOLDOWN)
+            elif self.failures < BREAKER_FAILURE_THRESHOLD:
+                return
+
+            self.state = "open"
+            # jitter so workers do not all probe a recovering DB at once
+            self.retry_at = time.monotonic() + self.cooldown * random.uniform(0.5, 1.5)
+            print(f"DB CIRCUIT OPEN (retry in ~{self.cooldown:.0f}s)")
+
+    @property
+    def is_open(self):
+        return self.state != "closed"
+
+
+breaker = CircuitBreaker()
+
+
+def reset_after_fork():
+    # a forked worker must not inherit the parent's breaker verdict
+    breaker.reset()
+
+
+def db_available():
+    return bool(DATABASE_URL) and not breaker.is_open
+
 
 def get_db():
     if not DATABASE_URL:
         return None
 
+    if not breaker.allow():
+        return None
+
     try:
-        return psycopg2.connect(
+        conn = psycopg2.connect(
             DATABASE_URL,
-            cursor_factory=RealDictCursor
+            # RealDictCursor, or its span-recording subclass while profiling
+            cursor_factory=cursor_factory(),
+            connect_timeout=DB_CONNECT_TIMEOUT
         )
     except Exception as e:
         print("Database connection error:", e)
+        breaker.record_failure()
         return None
 
+    breaker.record_success()
+    return conn
+
+
+def _run_once(cur, name, sql):
+    """Run a data backfill the first time init_db sees it, never again.
+
+    Rows a backfill can't fill (unparseable input) would otherwise be
+    rescanned on every boot.
+    """
+    cur.execute(
+        "INSERT INTO schema_migrations (name, applied_at) VALUES (%s, now()) "
+        "ON CONFLICT (name) DO NOTHING RETURNING name",
+        (name,)
+    )
+    if cur.fetchone() is None:
+        return
+    cur.execute(sql)
+    print("MIGRATION APPLIED:", name, f"({cur.rowcount} rows)")
+
 
 def init_db():
     conn = get_db()
@@ -28,6 +133,14 @@ def init_db():
 
     cur = conn.cursor()
 
+    # one-off backfills already applied (see _run_once)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        name TEXT PRIMARY KEY,
+        applied_at TIMESTAMPTZ NOT NULL
+    );
+    """)
+
     # -----------------------------
     # USERS
     # -----------------------------
@@ -65,6 +178,87 @@ def init_db():
     );
     """)
 
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_products_category ON products (category);
+    """)
+
+    # -----------------------------
+    # CATEGORY FACETS (maintained on product writes)
+    # -----------------------------
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS category_facets (
+        category TEXT PRIMARY KEY,
+        products INTEGER NOT NULL,
+        in_stock INTEGER NOT NULL,
+        min_price NUMERIC,
+        max_price NUMERIC,
+        updated_at TIMESTAMP
+    );
+    """)
+
+    # bumped on every catalog write; workers compare it when NOTIFY is missed
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS catalog_meta (
+        id INTEGER PRIMARY KEY,
+        version BIGINT NOT NULL
+    );
+    """)
+    cur.execute("""
+    INSERT INTO catalog_meta (id, version) VALUES (1, 0)
+    ON CONFLICT (id) DO NOTHING;
+    """)
+
+    # -----------------------------
+    # STOCK HOLDS (checkout reservations, see app/stock.py)
+    # -----------------------------
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS stock_hold_shards (
+        product_id INTEGER NOT NULL,
+        shard SMALLINT NOT NULL,
+        capacity INTEGER NOT NULL,
+        held INTEGER NOT NULL DEFAULT 0,
+        sold INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (product_id, shard)
+    );
+    """)
+    cur.execute("""
+    ALTER TABLE stock_hold_shards ADD COLUMN IF NOT EXISTS sold INTEGER NOT NULL DEFAULT 0;
+    """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS stock_holds (
+        id BIGSERIAL PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        shard SMALLINT NOT NULL,
+        quantity INTEGER NOT NULL,
+        expires_at TIMESTAMPTZ NOT NULL,
+        created_at TIMESTAMPTZ NOT NULL
+    );
+    """)
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_stock_holds_user ON stock_holds (user_id);
+    """)
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_stock_holds_expiry ON stock_holds (expires_at);
+    """)
+    # stock net of units sold but not yet folded into products.stock
+    cur.execute("""
+    DROP VIEW IF EXISTS product_availability;
+    """)
+    cur.execute("""
+    CREATE VIEW product_availability AS
+    SELECT p.id AS product_id,
+           p.stock - COALESCE(sum(h.sold), 0) AS stock,
+           COALESCE(sum(h.held), 0) AS held,
+           p.stock - COALESCE(sum(h.sold), 0) - COALESCE(sum(h.held), 0) AS available
+    FROM products p
+    LEFT JOIN stock_hold_shards h ON h.product_id = p.id
+    GROUP BY p.id, p.stock;
+    """)
+
+    from app.stock import ensure_shards
+    ensure_shards(cur)
+
     # -----------------------------
     # ORDERS
     # -----------------------------
@@ -86,6 +280,38 @@ def init_db():
     );
     """)
 
+    # numeric copies of the TEXT coordinates for the dispatch planner
+    cur.execute("""
+    ALTER TABLE orders
+        ADD COLUMN IF NOT EXISTS lat DOUBLE PRECISION,
+        ADD COLUMN IF NOT EXISTS lng DOUBLE PRECISION;
+    """)
+    # CASE so the cast only runs on text that looks like a number; new
+    # orders get lat/lng from place_order
+    _run_once(cur, "orders_lat_lng", """
+    UPDATE orders SET lat = c.lat, lng = c.lng
+    FROM (
+        SELECT id,
+            CASE WHEN latitude ~ '^\\s*-?[0-9]+(\\.[0-9]+)?\\s*$'
+                 THEN latitude::double precision END AS lat,
+            CASE WHEN longitude ~ '^\\s*-?[0-9]+(\\.[0-9]+)?\\s*$'
+                 THEN longitude::double precision END AS lng
+        FROM orders
+        WHERE lat IS NULL
+    ) c
+    WHERE orders.id = c.id
+      AND abs(c.lat) <= 90
+      AND abs(c.lng) <= 180;
+    """)
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_orders_open
+        ON orders (id) WHERE status IN ('PENDING', 'CONFIRMED');
+    """)
+    # customer order history (/account/orders)
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_orders_user ON orders (user_id, id DESC);
+    """)
+
     # -----------------------------
     # ORDER ITEMS
     # -----------------------------
@@ -100,6 +326,224 @@ def init_db():
     );
     """)
 
+    # -----------------------------
+    # ADMIN ORDER SEARCH
+    # -----------------------------
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_orders_phone ON orders (phone text_pattern_ops);
+    """)
+
+    # pg_trgm needs CREATE privilege on the database; search falls back to
+    # id/phone lookups and unindexed ILIKE without it
+    cur.execute("SAVEPOINT pg_trgm")
+    try:
+        cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        cur.execute("RELEASE SAVEPOINT pg_trgm")
+    except Exception as e:
+        print("pg_trgm unavailable:", e)
+        cur.execute("ROLLBACK TO SAVEPOINT pg_trgm")
+
+    cur.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+    if cur.fetchone():
+        cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_orders_name_trgm
+            ON orders USING gin (name gin_trgm_ops);
+        """)
+        cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_orders_address_trgm
+            ON orders USING gin (address gin_trgm_ops);
+        """)
+
+    # partition key for order_items once orders are partitioned by month
+    cur.execute("""
+    ALTER TABLE order_items ADD COLUMN IF NOT EXISTS order_created_at TIMESTAMP;
+    """)
+    # new items are inserted with it
+    _run_once(cur, "order_items_order_created_at", """
+    UPDATE order_items i SET order_created_at = o.created_at
+    FROM orders o
+    WHERE i.order_id = o.id AND i.order_created_at IS NULL;
+    """)
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items (order_id);
+    """)
+
+    # -----------------------------
+    # ORDER ARCHIVE (see app/archive.py)
+    # -----------------------------
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS order_archive (
+        order_id INTEGER PRIMARY KEY,
+        user_id INTEGER,
+        created_at TIMESTAMP,
+        total NUMERIC NOT NULL,
+        status TEXT NOT NULL,
+        block_id BIGINT
+    );
+    """)
+    # gzip JSONL, ARCHIVE_BLOCK_ORDERS orders per row; already compressed,
+    # so TOAST stores it out of line without compressing it again
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS order_archive_blocks (
+        id BIGSERIAL PRIMARY KEY,
+        month DATE NOT NULL,
+        orders INTEGER NOT NULL,
+        data BYTEA NOT NULL
+    );
+    """)
+    cur.execute("""
+    ALTER TABLE order_archive_blocks ALTER COLUMN data SET STORAGE EXTERNAL;
+    """)
+    # archives used to be local gzip files that other dynos could not read
+    cur.execute("""
+    ALTER TABLE order_archive
+        ADD COLUMN IF NOT EXISTS block_id BIGINT,
+        DROP COLUMN IF EXISTS file,
+        DROP COLUMN IF EXISTS block_offset;
+    """)
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_order_archive_user ON order_archive (user_id);
+    """)
+
+    # -----------------------------
+    # RATE LIMITS (shared token buckets)
+    # -----------------------------
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS rate_limits (
+        key TEXT PRIMARY KEY,
+        tokens DOUBLE PRECISION NOT NULL,
+        allowed BOOLEAN NOT NULL DEFAULT TRUE,
+        updated_at TIMESTAMPTZ NOT NULL
+    );
+    """)
+
+    # -----------------------------
+    # BACKGROUND JOBS
+    # -----------------------------
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS jobs (
+        id BIGSERIAL PRIMARY KEY,
+        name TEXT NOT NULL,
+        payload JSONB NOT NULL DEFAULT '{}',
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        max_attempts INTEGER NOT NULL,
+        run_at TIMESTAMPTZ NOT NULL,
+        locked_at TIMESTAMPTZ,
+        locked_by TEXT,
+        last_error TEXT,
+        duration_ms DOUBLE PRECISION,
+        created_at TIMESTAMPTZ NOT NULL,
+        finished_at TIMESTAMPTZ
+    );
+    """)
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_jobs_queued
+        ON jobs (run_at, id) WHERE status = 'queued';
+    """)
+    # the periodic scheduler's "pending or ran recently" check
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_jobs_name_status
+        ON jobs (name, status, finished_at);
+    """)
+    # retention deletes
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_jobs_finished
+        ON jobs (finished_at) WHERE status IN ('done', 'dead');
+    """)
+
+    # -----------------------------
+    # SALES REPORTS (summary tables, see app/reports.py)
+    # -----------------------------
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_orders_created_at ON orders (created_at);
+    """)
+
+    # order writes queue their day here in the same transaction
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS report_queue (
+        id BIGSERIAL PRIMARY KEY,
+        order_id INTEGER,
+        day DATE NOT NULL
+    );
+    """)
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS sales_daily_product (
+        day DATE NOT NULL,
+        product_id INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        category TEXT NOT NULL,
+        orders INTEGER NOT NULL,
+        units INTEGER NOT NULL,
+        revenue NUMERIC NOT NULL,
+        PRIMARY KEY (day, product_id)
+    );
+    """)
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS sales_weekly_category (
+        week DATE NOT NULL,
+        category TEXT NOT NULL,
+        units INTEGER NOT NULL,
+        revenue NUMERIC NOT NULL,
+        PRIMARY KEY (week, category)
+    );
+    """)
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS report_state (
+        name TEXT PRIMARY KEY,
+        refreshed_at TIMESTAMPTZ NOT NULL
+    );
+    """)
+
+    # -----------------------------
+    # RECOMMENDATIONS (see app/recommendations.py)
+    # -----------------------------
+    # placed orders queue themselves here in the same transaction
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS recommendation_queue (
+        id BIGSERIAL PRIMARY KEY,
+        order_id INTEGER NOT NULL
+    );
+    """)
+
+    # orders containing each product, and each pair (stored both ways)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS product_order_counts (
+        product_id INTEGER PRIMARY KEY,
+        orders INTEGER NOT NULL
+    );
+    """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS product_cooccurrence (
+        product_id INTEGER NOT NULL,
+        other_id INTEGER NOT NULL,
+        orders INTEGER NOT NULL,
+        PRIMARY KEY (product_id, other_id)
+    );
+    """)
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS product_recommendations (
+        product_id INTEGER NOT NULL,
+        rank SMALLINT NOT NULL,
+        recommended_id INTEGER NOT NULL,
+        score REAL NOT NULL,
+        PRIMARY KEY (product_id, rank)
+    );
+    """)
+
+    # keep monthly order partitions ahead of the calendar
+    from app.archive import is_partitioned, ensure_partitions
+    if is_partitioned(cur):
+        ensure_partitions(cur)
+
+    # facets may predate this table or a manual products edit
+    from app.catalog import refresh_category_facets
+    refresh_category_facets(cur)
+
     conn.commit()
     conn.close()
 
@@ -0,0 +1,152 @@
+from urllib.parse import urlencode
+
+import numpy as np
+
+from app.config import DISPATCH_BATCH_SIZE, DISPATCH_RADIUS_KM, DISPATCH_DEPOT
+from app.database import get_db
+from app.models import Order, parse_coordinates
+
+EARTH_RADIUS_KM = 6371.0088
+
+DISPATCH_STATUSES = ("PENDING", "CONFIRMED")
+
+
+# -----------------------------
+# GEOMETRY (vectorized)
+# -----------------------------
+def haversine_km(lat, lng, lats, lngs):
+    """Great-circle km from one point (degrees) to arrays of points."""
+    lat1, lng1 = np.radians(lat), np.radians(lng)
+    lat2, lng2 = np.radians(lats), np.radians(lngs)
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def pairwise_km(lats, lngs):
+    """Full distance matrix for a small set of points (one batch)."""
+    return haversine_km(lats[:, None], lngs[:, None], lats[None, :], lngs[None, :])
+
+
+def _depot():
+    if not DISPATCH_DEPOT:
+        return None
+    lat, _, lng = DISPATCH_DEPOT.partition(",")
+    return parse_coordinates(lat, lng)
+
+
+# -----------------------------
+# BATCHING
+# -----------------------------
+def _route_order(lats, lngs, start):
+    """Nearest-neighbour stop order within a batch, from ``start`` (lat, lng)."""
+    dist = pairwise_km(lats, lngs)
+    remaining = np.ones(len(lats), dtype=bool)
+    current = int(np.argmin(haversine_km(start[0], start[1], lats, lngs)))
+    order = [current]
+    remaining[current] = False
+
+    while remaining.any():
+        d = np.where(remaining, dist[current], np.inf)
+        current = int(np.argmin(d))
+        order.append(current)
+        remaining[current] = False
+
+    return order
+
+
+def plan_batches(lats, lngs, cap=DISPATCH_BATCH_SIZE, radius_km=DISPATCH_RADIUS_KM, depot=None):
+    """Group points into batches of at most ``cap`` stops within ``radius_km`` of a seed.
+
+    Seeds are taken farthest-first from the depot (or the centroid), so
+    outlying orders start their own batch instead of being left for last.
+    Each round is one vectorized distance pass over the unassigned points.
+    Returns a list of index lists, each in suggested visiting order.
+    """
+    n = len(lats)
+    if n == 0:
+        return []
+
+    origin = depot or (float(lats.mean()), float(lngs.mean()))
+    from_origin = haversine_km(origin[0], origin[1], lats, lngs)
+    unassigned = np.ones(n, dtype=bool)
+    batches = []
+
+    while unassigned.any():
+        # only the still-unassigned points take part in each pass
+        open_idx = np.flatnonzero(unassigned)
+        seed = open_idx[int(np.argmax(from_origin[open_idx]))]
+        d = haversine_km(lats[seed], lngs[seed], lats[open_idx], lngs[open_idx])
+
+        near = np.flatnonzero(d <= radius_km)
+        if len(near) > cap:
+            near = near[np.argpartition(d[near], cap - 1)[:cap]]
+        members = open_idx[near]
+        unassigned[members] = False
+
+        stops = _route_order(lats[members], lngs[members], origin)
+        batches.append([int(members[i]) for i in stops])
+
+    return batches
+
+
+def route_link(stops, depot=None):
+    """Google Maps directions through ``stops`` [(lat, lng)], from the depot if set."""
+    params = {"api": "1", "travelmode": "driving"}
+    if depot:
+        params["origin"] = f"{depot[0]},{depot[1]}"
+    params["destination"] = f"{stops[-1][0]},{stops[-1][1]}"
+    if len(stops) > 1:
+        params["waypoints"] = "|".join(f"{lat},{lng}" for lat, lng in stops[:-1])
+    return "https://www.google.com/maps/dir/?" + urlencode(params, safe=",|")
+
+
+# -----------------------------
+# PLANNER (admin /dispatch)
+# -----------------------------
+def load_dispatch_plan():
+    """Open orders grouped into delivery batches, plus the ones without a location."""
+    conn = get_db()
+    if not conn:
+        return None
+
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT id, name, phone, address, landmark, total, status,
+                   created_at, map_link, lat, lng
+            FROM orders
+            WHERE status IN %s
+            ORDER BY id
+        """, (DISPATCH_STATUSES,))
+        rows = cur.fetchall()
+    finally:
+        conn.close()
+
+    located = [r for r in rows if r["lat"] is not None and r["lng"] is not None]
+    unlocated = [Order.from_row(r) for r in rows if r["lat"] is None or r["lng"] is None]
+
+    lats = np.fromiter((r["lat"] for r in located), dtype=np.float64, count=len(located))
+    lngs = np.fromiter((r["lng"] for r in located), dtype=np.float64, count=len(located))
+
+    depot = _depot()
+    batches = []
+    for members in plan_batches(lats, lngs, depot=depot):
+        orders = [Order.from_row(located[i]) for i in members]
+        stops = [(located[i]["lat"], located[i]["lng"]) for i in members]
+        spread = pairwise_km(lats[members], lngs[members]).max() if len(members) > 1 else 0.0
+        batches.append({
+            "orders": orders,
+            "route": route_link(stops, depot),
+            "spread_km": round(float(spread), 1),
+            "total_paise": sum(o.total_paise for o in orders),
+        })
+
+    return {
+        "batches": batches,
+        "unlocated": unlocated,
+        "orders": len(rows),
+        "depot": depot,
+    }
@@ -0,0 +1,142 @@
+import os
+import re
+import time
+
+from app import jobs
+from app.config import BASE_DIR, IMAGE_GC_GRACE_HOURS, IMAGE_GC_INTERVAL
+from app.database import get_db
+from app.storage import get_storage
+
+# Uploads written before content-addressed storage: uuid4().hex + ext in
+# app/static/images. Anything else in that folder is a site asset.
+LEGACY_UPLOAD_DIR = os.path.join(BASE_DIR, "static", "images")
+LEGACY_UPLOAD_NAME = re.compile(r"^[0-9a-f]{32}\.(jpg|jpeg|png|webp)$")
+
+# pg_try_advisory_lock key so only one sweep runs at a time
+GC_LOCK_KEY = 0x1A6E_6C00
+
+
+def _referenced(cur):
+    cur.execute("""
+        SELECT DISTINCT jsonb_array_elements_text(images) AS name
+        FROM products
+        WHERE jsonb_typeof(images) = 'array'
+    """)
+    return {row["name"] for row in cur.fetchall()}
+
+
+def _candidates():
+    """(name, mtime, path, delete) for every collectable file."""
+    storage = get_storage()
+    for name, mtime in storage.list():
+        yield name, mtime, storage.path(name), storage.delete
+
+    try:
+        entries = list(os.scandir(LEGACY_UPLOAD_DIR))
+    except OSError:
+        entries = []
+
+    for entry in entries:
+        if entry.is_file() and LEGACY_UPLOAD_NAME.match(entry.name):
+            yield entry.name, entry.stat().st_mtime, entry.path, lambda _, p=entry.path: _remove(p)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def collect_orphaned_images(dry_run=False, grace_hours=None):
+    """Delete image files no product references and older than the grace period.
+
+    Uploads land on disk before their product row commits, and a dedup hit
+    reuses an existing file by refreshing its mtime. Each orphan is
+    re-stat'd just before it is unlinked, so a file touched by an upload
+    after the listing (even an old orphan) is kept for another grace period.
+    """
+    grace_hours = IMAGE_GC_GRACE_HOURS if grace_hours is None else grace_hours
+    report = {
+        "dry_run": dry_run,
+        "locked": False,
+        "scanned": 0,
+        "referenced": 0,
+        "recent": 0,
+        "orphans": [],
+        "bytes": 0,
+    }
+
+    conn = get_db()
+    if not conn:
+        raise RuntimeError("Database unavailable")
+
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT pg_try_advisory_lock(%s) AS ok", (GC_LOCK_KEY,))
+        if not cur.fetchone()["ok"]:
+            report["locked"] = True
+            return report
+
+        try:
+            # the mtimes below are only a first pass; see the re-stat before delete
+            files = list(_candidates())
+            referenced = _referenced(cur)
+            cutoff = time.time() - grace_hours * 3600
+
+            for name, mtime, path, delete in files:
+                report["scanned"] += 1
+                if name in referenced:
+                    report["referenced"] += 1
+                    continue
+                if mtime > cutoff:
+                    report["recent"] += 1
+                    continue
+
+                # a dedup hit may have touched it since the listing
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if st.st_mtime > cutoff:
+                    report["recent"] += 1
+                    continue
+                size = st.st_size
+
+                if dry_run or delete(name):
+                    report["orphans"].append(name)
+                    report["bytes"] += size
+        finally:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (GC_LOCK_KEY,))
+            conn.commit()
+    finally:
+        conn.close()
+
+    return report
+
+
+def print_report(report):
+    if report["locked"]:
+        print("IMAGE GC: another sweep is running, skipped")
+        return
+
+    action = "would delete" if report["dry_run"] else "deleted"
+    print(
+        f"IMAGE GC: scanned={report['scanned']} referenced={report['referenced']} "
+        f"within-grace={report['recent']} {action}={len(report['orphans'])} "
+        f"({report['bytes'] / (1024 * 1024):.1f} MB)"
+    )
+    for name in report["orphans"]:
+        print("  ", name)
+
+
+@jobs.register("gc_images")
+def gc_images_job(payload):
+    print_report(collect_orphaned_images(
+        dry_run=payload.get("dry_run", False),
+        grace_hours=payload.get("grace_hours"),
+    ))
+
+
+jobs.every(IMAGE_GC_INTERVAL, "gc_images")
@@ -0,0 +1,104 @@
+from datetime import timedelta
+
+from flask import render_template
+from markupsafe import Markup
+
+from app import listener
+from app.archive import load_archived_order
+from app.cache import TTLCache
+from app.database import get_db
+from app.models import Order
+from app.order_feed import CHANNEL as ORDERS_CHANNEL
+
+# most invoices one batch request renders
+INVOICE_BATCH_LIMIT = 500
+
+# (order_id, status) -> rendered invoice_body.html; status in the key so a
+# missed invalidation never prints a stale status
+invoice_cache = TTLCache(ttl=24 * 3600, maxsize=2000)
+
+
+# -----------------------------
+# RENDER CACHE
+# -----------------------------
+def render_invoice(order):
+    key = (order.id, order.status)
+    html = invoice_cache.get(key)
+    if html is None:
+        html = Markup(render_template("admin/invoice_body.html", order=order))
+        invoice_cache.set(key, html)
+    return html
+
+
+def invalidate_invoice(order_id):
+    invoice_cache.pop_where(lambda key: key[0] == order_id)
+
+
+# other workers' status updates and deletes
+listener.subscribe(ORDERS_CHANNEL, lambda payload: invalidate_invoice(payload.get("id")))
+
+
+# -----------------------------
+# BATCH LOADING (two queries)
+# -----------------------------
+def load_invoice_orders(ids=None, start=None, end=None):
+    """Orders with items by id list or created_at date range (inclusive).
+
+    Returns (orders, truncated). Ids not found in the live tables are
+    looked up in the order archive.
+    """
+    conn = get_db()
+    if not conn:
+        return None, False
+
+    try:
+        cur = conn.cursor()
+        if ids is not None:
+            cur.execute(
+                "SELECT * FROM orders WHERE id = ANY(%s) ORDER BY id LIMIT %s",
+                (list(ids), INVOICE_BATCH_LIMIT + 1)
+            )
+        else:
+            cur.execute("""
+                SELECT * FROM orders
+                WHERE created_at >= %s AND created_at < %s
+                ORDER BY id
+                LIMIT %s
+            """, (start, end + timedelta(days=1), INVOICE_BATCH_LIMIT + 1))
+        rows = cur.fetchall()
+        truncated = len(rows) > INVOICE_BATCH_LIMIT
+        rows = rows[:INVOICE_BATCH_LIMIT]
+
+        items = {}
+        if rows:
+            sql = """
+                SELECT order_id, product_id, name, price, quantity
+                FROM order_items
+                WHERE order_id = ANY(%s)
+            """
+            params = [[o["id"] for o in rows]]
+
+            # date bounds let Postgres prune order_items partitions
+            dates = [o["created_at"] for o in rows]
+            if None not in dates:
+                sql += " AND order_created_at BETWEEN %s AND %s"
+                params += [min(dates), max(dates)]
+
+            cur.execute(sql + " ORDER BY id", params)
+            for i in cur.fetchall():
+                items.setdefault(i["order_id"], []).append(i)
+
+        orders = [Order.from_row(o, items.get(o["id"], ())) for o in rows]
+
+        if ids is not None and not truncated:
+            found = {o.id for o in orders}
+            for order_id in ids:
+                if order_id not in found:
+                    archived = load_archived_order(order_id, cur)
+                    if archived:
+                        orders.append(archived)
+            orders.sort(key=lambda o: o.id)
+
+        return orders, truncated
+    finally:
+        conn.close()
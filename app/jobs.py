@@ -0,0 +1,347 @@
+import os
+import random
+import signal
+import socket
+import threading
+import time
+import traceback
+
+from psycopg2.extras import Json
+
+from app.config import (
+    JOB_MAX_ATTEMPTS,
+    JOB_BACKOFF_SECONDS,
+    JOB_TIMEOUT,
+    JOB_LOCK_TIMEOUT,
+    JOB_POLL_INTERVAL,
+    JOB_DONE_RETENTION_DAYS,
+    JOB_DEAD_RETENTION_DAYS,
+)
+from app.database import get_db
+
+# name -> callable(payload)
+HANDLERS = {}
+
+# name -> seconds a single run may take
+TIMEOUTS = {}
+
+# rows per retention DELETE, so one pass never holds a long lock
+PRUNE_BATCH = 5000
+
+# [name, interval seconds, next due (monotonic)] enqueued by the worker itself
+PERIODIC = []
+
+# name -> {"runs", "failures", "total_ms", "max_ms"} for this worker process
+STATS = {}
+
+
+# -----------------------------
+# REGISTRATION / ENQUEUE
+# -----------------------------
+class JobTimeout(Exception):
+    pass
+
+
+def register(name, timeout=None):
+    def decorator(func):
+        HANDLERS[name] = func
+        TIMEOUTS[name] = timeout or JOB_TIMEOUT
+        return func
+    return decorator
+
+
+def every(interval, name):
+    """Have ``flask worker`` enqueue ``name`` roughly every ``interval`` seconds."""
+    PERIODIC.append([name, interval, 0.0])
+
+
+def enqueue(name, payload=None, conn=None, delay=0, max_attempts=None):
+    """Queue a job.
+
+    Pass the caller's ``conn`` to insert inside its transaction, so the job
+    only becomes visible if the surrounding write commits.
+    """
+    params = (
+        name,
+        Json(payload or {}),
+        max_attempts or JOB_MAX_ATTEMPTS,
+        delay,
+    )
+    sql = """
+        INSERT INTO jobs (name, payload, status, attempts, max_attempts, run_at, created_at)
+        VALUES (%s, %s, 'queued', 0, %s, now() + make_interval(secs => %s), now())
+        RETURNING id
+    """
+
+    if conn is not None:
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        return cur.fetchone()["id"]
+
+    own = get_db()
+    if not own:
+        print("JOB NOT QUEUED (DB unavailable):", name)
+        return None
+
+    try:
+        cur = own.cursor()
+        cur.execute(sql, params)
+        job_id = cur.fetchone()["id"]
+        own.commit()
+        return job_id
+    finally:
+        own.close()
+
+
+# -----------------------------
+# WORKER
+# -----------------------------
+def _worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _claim(conn):
+    cur = conn.cursor()
+    cur.execute("""
+        UPDATE jobs SET
+            status = 'running',
+            attempts = attempts + 1,
+            locked_at = now(),
+            locked_by = %s
+        WHERE id = (
+            SELECT id FROM jobs
+            WHERE status = 'queued' AND run_at <= now()
+            ORDER BY run_at, id
+            FOR UPDATE SKIP LOCKED
+            LIMIT 1
+        )
+        RETURNING id, name, payload, attempts, max_attempts
+    """, (_worker_id(),))
+    job = cur.fetchone()
+    conn.commit()
+    return job
+
+
+def _requeue_stale(conn):
+    # a worker died mid-job; the lost run counts as an attempt, so a job
+    # that keeps killing its worker ends up dead instead of looping
+    cur = conn.cursor()
+    cur.execute("""
+        UPDATE jobs SET status = 'dead', finished_at = now(),
+            locked_at = NULL, last_error = 'worker lost or timed out'
+        WHERE status = 'running'
+          AND locked_at < now() - make_interval(secs => %s)
+          AND attempts >= max_attempts
+    """, (JOB_LOCK_TIMEOUT,))
+    dead = cur.rowcount
+    cur.execute("""
+        UPDATE jobs SET status = 'queued', locked_at = NULL, locked_by = NULL,
+            last_error = 'worker lost or timed out'
+        WHERE status = 'running'
+          AND locked_at < now() - make_interval(secs => %s)
+    """, (JOB_LOCK_TIMEOUT,))
+    conn.commit()
+    if dead:
+        print("JOBS DEAD (stale locks, out of attempts):", dead)
+    if cur.rowcount:
+        print("JOBS REQUEUED (stale locks):", cur.rowcount)
+
+
+def _prune_finished(conn):
+    # periodic jobs add thousands of rows a day; keep a window for `flask jobs`
+    cur = conn.cursor()
+    pruned = 0
+    for status, days in (("done", JOB_DONE_RETENTION_DAYS), ("dead", JOB_DEAD_RETENTION_DAYS)):
+        while True:
+            cur.execute("""
+                DELETE FROM jobs WHERE id IN (
+                    SELECT id FROM jobs
+                    WHERE status = %s
+                      AND finished_at < now() - make_interval(days => %s)
+                    LIMIT %s
+                )
+            """, (status, days, PRUNE_BATCH))
+            conn.commit()
+            pruned += cur.rowcount
+            if cur.rowcount < PRUNE_BATCH:
+                break
+    if pruned:
+        print("JOBS PRUNED (finished):", pruned)
+
+
+def _schedule_periodic(conn):
+    now = time.monotonic()
+    cur = conn.cursor()
+
+    for task in PERIODIC:
+        name, interval, due = task
+        if now < due:
+            continue
+        task[2] = now + interval
+
+        # several workers share one schedule: skip if one is pending or ran recently
+        cur.execute("""
+            INSERT INTO jobs (name, payload, status, attempts, max_attempts, run_at, created_at)
+            SELECT %(name)s, '{}', 'queued', 0, %(attempts)s, now(), now()
+            WHERE NOT EXISTS (
+                SELECT 1 FROM jobs
+                WHERE name = %(name)s
+                  AND (status IN ('queued', 'running')
+                       OR finished_at > now() - make_interval(secs => %(interval)s))
+            )
+        """, {"name": name, "attempts": JOB_MAX_ATTEMPTS, "interval": interval})
+
+    conn.commit()
+
+
+def _record(name, elapsed_ms, failed):
+    stats = STATS.setdefault(
+        name, {"runs": 0, "failures": 0, "total_ms": 0.0, "max_ms": 0.0}
+    )
+    stats["runs"] += 1
+    stats["failures"] += int(failed)
+    stats["total_ms"] += elapsed_ms
+    stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+
+
+def _backoff(attempts):
+    delay = JOB_BACKOFF_SECONDS * (2 ** (attempts - 1))
+    return min(delay, 3600) * random.uniform(0.8, 1.2)
+
+
+def _on_timeout(signum, frame):
+    raise JobTimeout("job exceeded its timeout")
+
+
+def _call(handler, payload, timeout):
+    # SIGALRM only works on the main thread (flask worker); a handler
+    # blocked inside one C call (a slow query) is interrupted when it returns
+    if threading.current_thread() is not threading.main_thread():
+        return handler(payload)
+
+    previous = signal.signal(signal.SIGALRM, _on_timeout)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return handler(payload)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def run_job(conn, job):
+    handler = HANDLERS.get(job["name"])
+    started = time.perf_counter()
+    error = None
+
+    try:
+        if handler is None:
+            raise LookupError(f"No handler registered for {job['name']!r}")
+        _call(handler, job["payload"], TIMEOUTS.get(job["name"], JOB_TIMEOUT))
+    except Exception:
+        error = traceback.format_exc()
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    _record(job["name"], elapsed_ms, error is not None)
+
+    cur = conn.cursor()
+    if error is None:
+        cur.execute("""
+            UPDATE jobs SET status = 'done', finished_at = now(),
+                duration_ms = %s, locked_at = NULL, last_error = NULL
+            WHERE id = %s
+        """, (elapsed_ms, job["id"]))
+    elif job["attempts"] >= job["max_attempts"]:
+        cur.execute("""
+            UPDATE jobs SET status = 'dead', finished_at = now(),
+                duration_ms = %s, locked_at = NULL, last_error = %s
+            WHERE id = %s
+        """, (elapsed_ms, error, job["id"]))
+        print(f"JOB DEAD: {job['name']} #{job['id']}\n{error}")
+    else:
+        cur.execute("""
+            UPDATE jobs SET status = 'queued',
+                run_at = now() + make_interval(secs => %s),
+                duration_ms = %s, locked_at = NULL, last_error = %s
+            WHERE id = %s
+        """, (_backoff(job["attempts"]), elapsed_ms, error, job["id"]))
+        print(f"JOB FAILED: {job['name']} #{job['id']} attempt {job['attempts']}")
+
+    conn.commit()
+
+
+def print_stats():
+    for name, s in sorted(STATS.items()):
+        avg = s["total_ms"] / s["runs"] if s["runs"] else 0
+        print(
+            f"JOB STATS {name}: runs={s['runs']} failures={s['failures']} "
+            f"avg={avg:.1f}ms max={s['max_ms']:.1f}ms"
+        )
+
+
+def run_worker(burst=False):
+    """Process jobs until interrupted (or until the queue is empty if burst)."""
+    print("JOB WORKER STARTED:", _worker_id(), "handlers:", ", ".join(sorted(HANDLERS)))
+    last_maintenance = 0.0
+    conn = None
+
+    try:
+        while True:
+            if conn is None or conn.closed:
+                conn = get_db()
+                if not conn:
+                    if burst:
+                        break
+                    time.sleep(JOB_POLL_INTERVAL)
+                    continue
+
+            try:
+                if time.monotonic() - last_maintenance > JOB_LOCK_TIMEOUT:
+                    _requeue_stale(conn)
+                    _prune_finished(conn)
+                    print_stats()
+                    last_maintenance = time.monotonic()
+
+                if not burst:
+                    _schedule_periodic(conn)
+
+                job = _claim(conn)
+                if job:
+                    run_job(conn, job)
+                    continue
+            except Exception as e:
+                print("JOB WORKER ERROR:", e)
+                try:
+                    conn.close()
+                finally:
+                    conn = None
+
+            if burst:
+                break
+            time.sleep(JOB_POLL_INTERVAL)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if conn is not None and not conn.closed:
+            conn.close()
+        print_stats()
+
+
+def job_summary():
+    """Queue depth and timing per job name, for the admin panel / CLI."""
+    conn = get_db()
+    if not conn:
+        return []
+
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT name, status, count(*) AS jobs,
+                   round(avg(duration_ms)::numeric, 1) AS avg_ms,
+                   round(max(duration_ms)::numeric, 1) AS max_ms
+            FROM jobs
+            GROUP BY name, status
+            ORDER BY name, status
+        """)
+        return cur.fetchall()
+    finally:
+        conn.close()
@@ -0,0 +1,123 @@
+import json
+import os
+import select
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+from app.database import DATABASE_URL
+
+# channel -> [callback(payload)]
+_subscribers = {}
+
+# [interval, callback(conn), last_run] run from the listener thread
+_periodic = []
+
+_state = {"pid": None, "thread": None}
+_lock = threading.Lock()
+
+
+# -----------------------------
+# REGISTRATION
+# -----------------------------
+def subscribe(channel, callback):
+    _subscribers.setdefault(channel, []).append(callback)
+
+
+def every(interval, callback):
+    """Run ``callback(conn)`` from the listener thread every ``interval`` seconds.
+
+    Used as a fallback for notifications missed while disconnected; it also
+    runs right after every (re)connect.
+    """
+    _periodic.append([interval, callback, 0.0])
+
+
+def notify(cur, channel, payload):
+    """Queue a notification; Postgres delivers it when the transaction commits."""
+    cur.execute("SELECT pg_notify(%s, %s)", (channel, json.dumps(payload)))
+
+
+# -----------------------------
+# LISTENER THREAD (one per worker process)
+# -----------------------------
+def start_listener():
+    if not DATABASE_URL or not _subscribers:
+        return
+
+    pid = os.getpid()
+    if _state["pid"] == pid:
+        return
+
+    with _lock:
+        if _state["pid"] == pid:
+            return
+
+        # a forked worker inherits the flag but not the thread
+        thread = threading.Thread(target=_run, name="pg-listener", daemon=True)
+        _state["pid"] = pid
+        _state["thread"] = thread
+        thread.start()
+
+
+def _dispatch(notification):
+    try:
+        payload = json.loads(notification.payload) if notification.payload else {}
+    except ValueError:
+        payload = {"raw": notification.payload}
+
+    for callback in _subscribers.get(notification.channel, []):
+        try:
+            callback(payload)
+        except Exception as e:
+            print("LISTENER CALLBACK ERROR:", notification.channel, e)
+
+
+def _run_periodic(conn, force=False):
+    now = time.monotonic()
+    for task in _periodic:
+        interval, callback, last_run = task
+        if force or now - last_run >= interval:
+            task[2] = now
+            try:
+                callback(conn)
+            except Exception as e:
+                print("LISTENER PERIODIC ERROR:", e)
+
+
+def _run():
+    backoff = 1
+
+    while True:
+        conn = None
+        try:
+            conn = psycopg2.connect(DATABASE_URL, connect_timeout=5)
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+
+            cur = conn.cursor()
+            for channel in _subscribers:
+                cur.execute(f'LISTEN "{channel}"')
+
+            backoff = 1
+            # anything may have changed while we were not listening
+            _run_periodic(conn, force=True)
+
+            while True:
+                if select.select([conn], [], [], 5) != ([], [], []):
+                    conn.poll()
+                    while conn.notifies:
+                        _dispatch(conn.notifies.pop(0))
+                _run_periodic(conn)
+        except Exception as e:
+            print("LISTENER DISCONNECTED:", e)
+        finally:
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+
+        time.sleep(backoff)
+        backoff = min(backoff * 2, 60)
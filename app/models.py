@@ -0,0 +1,197 @@
+import json
+from decimal import Decimal, ROUND_HALF_UP
+
+
+# -----------------------------
+# MONEY (integer paise)
+# -----------------------------
+def to_paise(value):
+    if value is None or value == "":
+        return 0
+    if isinstance(value, int):
+        return value * 100
+    amount = value if isinstance(value, Decimal) else Decimal(str(value))
+    return int((amount * 100).quantize(Decimal("1"), rounding=ROUND_HALF_UP))
+
+
+def rupees(paise):
+    """Paise -> rupees for display/maths in templates (499, 499.5)."""
+    if paise is None:
+        return 0
+    return paise // 100 if paise % 100 == 0 else paise / 100
+
+
+def to_decimal(paise):
+    """Paise -> exact NUMERIC rupees for writes."""
+    return Decimal(paise) / 100
+
+
+def _decode_json(value):
+    if isinstance(value, str):
+        return json.loads(value)
+    return value or []
+
+
+# -----------------------------
+# PRODUCT
+# -----------------------------
+class Product:
+    """A products row. Card projections leave the TEXT fields as ""."""
+
+    __slots__ = (
+        "id", "name", "price_paise", "mrp_paise", "rating", "rating_count",
+        "delivery_days", "stock", "category", "badges", "images", "image",
+        "description", "ingredients", "nutrition", "dosage", "additional_info",
+    )
+
+    TEXT_FIELDS = ("description", "ingredients", "nutrition", "dosage", "additional_info")
+
+    @classmethod
+    def from_row(cls, row):
+        p = cls.__new__(cls)
+        p.id = row["id"]
+        p.name = row["name"]
+        p.price_paise = to_paise(row.get("price"))
+        p.mrp_paise = to_paise(row.get("mrp"))
+        rating = float(row.get("rating") or 0)
+        p.rating = int(rating) if rating.is_integer() else rating
+        p.rating_count = row.get("rating_count") or 0
+        p.delivery_days = row.get("delivery_days") or 0
+        p.stock = row.get("stock") or 0
+        p.category = row.get("category")
+        p.badges = _decode_json(row.get("badges"))
+        p.images = _decode_json(row.get("images")) if "images" in row else []
+        p.image = row.get("image") or (p.images[0] if p.images else "default.png")
+        for field in cls.TEXT_FIELDS:
+            setattr(p, field, row.get(field) or "")
+        return p
+
+    @classmethod
+    def from_dict(cls, data):
+        p = cls.__new__(cls)
+        for field in cls.__slots__:
+            setattr(p, field, data.get(field))
+        return p
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    @property
+    def price(self):
+        return rupees(self.price_paise)
+
+    @property
+    def mrp(self):
+        return rupees(self.mrp_paise)
+
+    def to_cart_item(self, quantity=1):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "price_paise": self.price_paise,
+            "image": self.image,
+            "quantity": quantity,
+        }
+
+
+# -----------------------------
+# ORDERS
+# -----------------------------
+class OrderItem:
+    __slots__ = ("product_id", "name", "price_paise", "quantity")
+
+    @classmethod
+    def from_row(cls, row):
+        i = cls.__new__(cls)
+        i.product_id = row.get("product_id")
+        i.name = row["name"]
+        i.price_paise = to_paise(row["price"])
+        i.quantity = row["quantity"]
+        return i
+
+    @property
+    def price(self):
+        return rupees(self.price_paise)
+
+    @property
+    def line_total(self):
+        return rupees(self.price_paise * self.quantity)
+
+    def to_dict(self):
+        return {
+            "product_id": self.product_id,
+            "name": self.name,
+            "price": self.price,
+            "quantity": self.quantity,
+        }
+
+
+def parse_coordinates(latitude, longitude):
+    """(lat, lng) floats from the checkout form's text fields, or None."""
+    try:
+        lat, lng = float(latitude), float(longitude)
+    except (TypeError, ValueError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None
+    return lat, lng
+
+
+class Order:
+    __slots__ = (
+        "id", "user_id", "name", "phone", "address", "landmark",
+        "payment_method", "latitude", "longitude", "map_link",
+        "total_paise", "status", "created_at", "items",
+    )
+
+    @classmethod
+    def from_row(cls, row, items=()):
+        o = cls.__new__(cls)
+        o.id = row["id"]
+        o.user_id = row.get("user_id")
+        o.name = row.get("name")
+        o.phone = row.get("phone")
+        o.address = row.get("address")
+        o.landmark = row.get("landmark")
+        o.payment_method = row.get("payment_method")
+        o.latitude = row.get("latitude")
+        o.longitude = row.get("longitude")
+        o.map_link = row.get("map_link")
+        o.total_paise = to_paise(row.get("total"))
+        o.status = row.get("status")
+        o.created_at = row.get("created_at")
+        o.items = [OrderItem.from_row(i) for i in items]
+        return o
+
+    @property
+    def total(self):
+        return rupees(self.total_paise)
+
+    @property
+    def date(self):
+        return self.created_at.strftime("%d %b %Y") if self.created_at else ""
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "phone": self.phone,
+            "address": self.address,
+            "landmark": self.landmark,
+            "payment_method": self.payment_method,
+            "map_link": self.map_link,
+            "total": self.total,
+            "status": self.status,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "items": [i.to_dict() for i in self.items],
+        }
+
+
+def cart_total_paise(cart, lookup):
+    """Sum cart lines at current catalog prices; ``lookup`` maps id -> Product."""
+    total = 0
+    for item in cart:
+        product = lookup(item["id"])
+        if product:
+            total += product.price_paise * item["quantity"]
+    return total
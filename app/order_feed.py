@@ -0,0 +1,120 @@
+import json
+import queue
+import threading
+import time
+
+from app import listener
+from app.models import to_paise
+from app.config import (
+    ORDER_FEED_MAX_CLIENTS,
+    ORDER_FEED_MAX_SECONDS,
+    ORDER_FEED_HEARTBEAT,
+)
+
+CHANNEL = "orders_changed"
+
+# events buffered per stream before a slow client is dropped
+CLIENT_QUEUE_SIZE = 100
+
+_clients = set()
+_clients_lock = threading.Lock()
+
+
+# -----------------------------
+# PUBLISH (inside the order write transaction)
+# -----------------------------
+def notify_order_changed(cur, event, order, **extra):
+    """NOTIFY orders_changed; delivered to every worker once the caller commits.
+
+    ``event`` is "placed", "status" or "deleted"; ``order`` is a row with
+    id, user_id, name, phone, total, status and created_at.
+    """
+    payload = {
+        "event": event,
+        "id": order["id"],
+        "user_id": order["user_id"],
+        "name": order["name"],
+        "phone": order["phone"],
+        "total_paise": to_paise(order["total"]),
+        "status": order["status"],
+        "created_at": order["created_at"].isoformat() if order["created_at"] else None,
+    }
+    payload.update(extra)
+    listener.notify(cur, CHANNEL, payload)
+
+
+# -----------------------------
+# FAN-OUT (listener thread -> open streams)
+# -----------------------------
+class _Client:
+    __slots__ = ("events", "dropped")
+
+    def __init__(self):
+        self.events = queue.Queue(maxsize=CLIENT_QUEUE_SIZE)
+        self.dropped = False
+
+
+def _broadcast(payload):
+    with _clients_lock:
+        clients = list(_clients)
+
+    for client in clients:
+        try:
+            client.events.put_nowait(payload)
+        except queue.Full:
+            # the browser stopped reading; its stream ends and it reloads
+            client.dropped = True
+
+
+listener.subscribe(CHANNEL, _broadcast)
+
+
+def _format(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def open_stream():
+    """An SSE generator, or None when this worker already serves enough streams."""
+    with _clients_lock:
+        if len(_clients) >= ORDER_FEED_MAX_CLIENTS:
+            return None
+
+    # the listener thread normally starts on the first request
+    listener.start_listener()
+
+    def generate():
+        # registered only once the response is being iterated, so a stream
+        # that is never started holds no slot; the finally below always runs
+        client = _Client()
+        with _clients_lock:
+            full = len(_clients) >= ORDER_FEED_MAX_CLIENTS
+            if not full:
+                _clients.add(client)
+        if full:
+            # filled up since open_stream(); the browser retries
+            yield "retry: 3000\n\n"
+            return
+
+        deadline = time.monotonic() + ORDER_FEED_MAX_SECONDS
+        try:
+            yield f"retry: 3000\n{_format('hello', {'max_seconds': ORDER_FEED_MAX_SECONDS})}"
+
+            while not client.dropped:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    payload = client.events.get(timeout=min(ORDER_FEED_HEARTBEAT, remaining))
+                except queue.Empty:
+                    # comment line; also how a closed socket gets noticed
+                    yield ": ping\n\n"
+                    continue
+                yield _format("order", payload)
+
+            if client.dropped:
+                yield _format("reset", {})
+        finally:
+            with _clients_lock:
+                _clients.discard(client)
+
+    return generate()
@@ -0,0 +1,74 @@
+from app import listener
+from app.cache import TTLCache
+from app.config import ORDER_HISTORY_CACHE_TTL
+from app.database import get_db
+from app.models import Order
+from app.order_feed import CHANNEL as ORDERS_CHANNEL
+
+# user_id -> [Order] newest first, items included
+order_history_cache = TTLCache(ttl=ORDER_HISTORY_CACHE_TTL, maxsize=4096)
+
+
+def invalidate_order_history(user_id):
+    if user_id is not None:
+        order_history_cache.pop(user_id)
+
+
+# other workers' placed orders, status updates and deletes
+listener.subscribe(ORDERS_CHANNEL, lambda payload: invalidate_order_history(payload.get("user_id")))
+
+
+def load_order_history(user_id):
+    """The user's orders with their items, newest first; None if the DB is down.
+
+    Archived orders carry their summary only: their items live in the
+    compressed archive blocks, one read per order (see load_archived_order).
+    """
+    orders = order_history_cache.get(user_id)
+    if orders is not None:
+        return orders
+
+    conn = get_db()
+    if not conn:
+        return None
+
+    try:
+        cur = conn.cursor()
+        # one row per item (or per order without items); the created_at
+        # match selects the order_items partition
+        cur.execute("""
+            SELECT o.id, o.name, o.phone, o.total, o.status, o.created_at,
+                   i.id AS item_id, i.product_id, i.name AS item_name,
+                   i.price, i.quantity
+            FROM orders o
+            LEFT JOIN order_items i
+              ON i.order_id = o.id
+             AND i.order_created_at IS NOT DISTINCT FROM o.created_at
+            WHERE o.user_id = %(user_id)s
+            UNION ALL
+            SELECT order_id, NULL, NULL, total, status, created_at,
+                   NULL, NULL, NULL, NULL, NULL
+            FROM order_archive
+            WHERE user_id = %(user_id)s
+            ORDER BY id DESC, item_id
+        """, {"user_id": user_id})
+        rows = cur.fetchall()
+    finally:
+        conn.close()
+
+    orders, items = [], {}
+    for r in rows:
+        if r["id"] not in items:
+            items[r["id"]] = []
+            orders.append(r)
+        if r["item_id"] is not None:
+            items[r["id"]].append({
+                "product_id": r["product_id"],
+                "name": r["item_name"],
+                "price": r["price"],
+                "quantity": r["quantity"],
+            })
+
+    orders = [Order.from_row(o, items[o["id"]]) for o in orders]
+    order_history_cache.set(user_id, orders)
+    return orders
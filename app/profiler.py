@@ -0,0 +1,275 @@
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+from flask import before_render_template, g, request, session, template_rendered
+from psycopg2.extras import RealDictCursor
+
+from app.config import (
+    PROJECT_ROOT,
+    PROFILING_ENABLED,
+    PROFILE_DIR,
+    PROFILE_INTERVAL,
+    PROFILE_MAX_SECONDS,
+    PROFILE_KEEP,
+)
+
+# An admin adds ?_profile=1 (or the X-Profile: 1 header) to any request.
+# A sampler thread then snapshots that request thread's Python stack every
+# PROFILE_INTERVAL and the counts are written as collapsed stacks
+# ("root;...;leaf count"), the input format of flamegraph.pl and
+# speedscope. The SQL statement or template being rendered at sample time
+# is appended as the leaf frame. Nothing is hooked unless a profile is
+# running: other requests only pay the flag check.
+
+PROFILE_NAME = re.compile(r"^(\d{8}-\d{6}-\d{6})_(.+)_(\d+)ms\.folded$")
+
+# request thread ident -> Profile
+_active = {}
+_lock = threading.Lock()
+
+# code object -> "qualname (file:line)"
+_labels = {}
+
+
+# -----------------------------
+# SAMPLER
+# -----------------------------
+class Profile:
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.thread_id = threading.get_ident()
+        self.stacks = Counter()
+        # innermost SQL/template span, read by the sampler thread
+        self.span = None
+        self._spans = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self):
+        self.started = time.monotonic()
+        self.started_at = datetime.now()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.elapsed = time.monotonic() - self.started
+
+    def push(self, label):
+        self._spans.append(self.span)
+        self.span = label
+
+    def pop(self):
+        if self._spans:
+            self.span = self._spans.pop()
+
+    @contextmanager
+    def spanning(self, label):
+        self.push(label)
+        try:
+            yield
+        finally:
+            self.pop()
+
+    def _run(self):
+        deadline = time.monotonic() + PROFILE_MAX_SECONDS
+        while not self._stop.wait(PROFILE_INTERVAL):
+            if time.monotonic() > deadline:
+                break
+
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            stack.reverse()
+
+            span = self.span
+            if span:
+                stack.append(span)
+            self.stacks[";".join(stack)] += 1
+
+    @property
+    def filename(self):
+        stamp = self.started_at.strftime("%Y%m%d-%H%M%S-%f")
+        return f"{stamp}_{self.endpoint}_{round(self.elapsed * 1000)}ms.folded"
+
+    def write(self):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        with open(os.path.join(PROFILE_DIR, self.filename), "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def _frame_label(code):
+    label = _labels.get(code)
+    if label is None:
+        path = code.co_filename
+        if path.startswith(PROJECT_ROOT):
+            path = os.path.relpath(path, PROJECT_ROOT)
+        else:
+            path = os.path.basename(path)
+        name = getattr(code, "co_qualname", code.co_name)
+        label = f"{name} ({path}:{code.co_firstlineno})".replace(";", ",")
+        _labels[code] = label
+    return label
+
+
+def _current_profile():
+    return _active.get(threading.get_ident())
+
+
+# -----------------------------
+# SQL AND TEMPLATE SPANS
+# -----------------------------
+def _sql_label(query):
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    elif not isinstance(query, str):
+        # psycopg2.sql.Composed
+        query = str(query)
+    return "SQL: " + " ".join(query.split())[:80].replace(";", ",")
+
+
+class ProfiledCursor(RealDictCursor):
+    def execute(self, query, vars=None):
+        profile = _current_profile()
+        if profile is None:
+            return super().execute(query, vars)
+        with profile.spanning(_sql_label(query)):
+            return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        profile = _current_profile()
+        if profile is None:
+            return super().executemany(query, vars_list)
+        with profile.spanning(_sql_label(query)):
+            return super().executemany(query, vars_list)
+
+
+def cursor_factory():
+    """Cursor class for get_db(): ProfiledCursor only on a profiled request."""
+    if _active and threading.get_ident() in _active:
+        return ProfiledCursor
+    return RealDictCursor
+
+
+def _template_started(sender, template, context, **extra):
+    profile = _current_profile()
+    if profile is not None:
+        profile.push(f"template: {template.name}")
+
+
+def _template_finished(sender, template, context, **extra):
+    profile = _current_profile()
+    if profile is not None:
+        profile.pop()
+
+
+# -----------------------------
+# REQUEST HOOKS
+# -----------------------------
+def start_request_profile():
+    # cheap flag check first; the session is only decoded for flagged requests
+    flagged = request.args.get("_profile") == "1" or request.headers.get("X-Profile") == "1"
+    if not flagged or not session.get("admin_logged_in"):
+        return None
+
+    profile = Profile(request.endpoint or "unknown")
+    with _lock:
+        if not _active:
+            before_render_template.connect(_template_started)
+            template_rendered.connect(_template_finished)
+        _active[profile.thread_id] = profile
+
+    g.profile = profile
+    profile.start()
+    return None
+
+
+def stop_request_profile(exc=None):
+    profile = g.pop("profile", None)
+    if profile is None:
+        return
+
+    with _lock:
+        _active.pop(profile.thread_id, None)
+        if not _active:
+            before_render_template.disconnect(_template_started)
+            template_rendered.disconnect(_template_finished)
+
+    profile.stop()
+    try:
+        profile.write()
+        prune_profiles()
+    except OSError as e:
+        print("PROFILE WRITE FAILED:", e)
+        return
+
+    print("PROFILE SAVED:", profile.filename, sum(profile.stacks.values()), "samples")
+
+
+def init_profiler(app):
+    if not PROFILING_ENABLED:
+        return
+
+    app.before_request(start_request_profile)
+    # teardown so streamed responses are profiled to the last byte
+    app.teardown_request(stop_request_profile)
+
+
+# -----------------------------
+# STORED PROFILES
+# -----------------------------
+def _profile_names():
+    try:
+        names = os.listdir(PROFILE_DIR)
+    except FileNotFoundError:
+        return []
+    return sorted((n for n in names if PROFILE_NAME.match(n)), reverse=True)
+
+
+def prune_profiles():
+    for name in _profile_names()[PROFILE_KEEP:]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, name))
+        except FileNotFoundError:
+            pass
+
+
+def list_profiles():
+    profiles = []
+    for name in _profile_names():
+        stamp, endpoint, elapsed_ms = PROFILE_NAME.match(name).groups()
+        path = os.path.join(PROFILE_DIR, name)
+        try:
+            with open(path) as f:
+                samples = sum(int(line.rsplit(" ", 1)[1]) for line in f if line.strip())
+        except (OSError, ValueError, IndexError):
+            continue
+
+        profiles.append({
+            "name": name,
+            "endpoint": endpoint,
+            "created_at": datetime.strptime(stamp, "%Y%m%d-%H%M%S-%f"),
+            "elapsed_ms": int(elapsed_ms),
+            "samples": samples,
+        })
+    return profiles
+
+
+def profile_path(name):
+    """Path of a stored profile, or None for unknown or unsafe names."""
+    if not PROFILE_NAME.match(name):
+        return None
+    path = os.path.join(PROFILE_DIR, name)
+    return path if os.path.isfile(path) else None
@@ -0,0 +1,289 @@
+import math
+import os
+import threading
+import time
+
+import psycopg2
+from flask import request, session, g, jsonify
+
+from app import jobs
+from app.config import (
+    RATE_LIMIT_BACKEND,
+    RATE_LIMIT_ENABLED,
+    RATE_LIMIT_PRUNE_INTERVAL,
+    DB_CONCURRENCY_LIMIT,
+    GUNICORN_THREADS,
+)
+from app.database import get_db
+
+
+# -----------------------------
+# LIMITS
+# -----------------------------
+# (tokens per second, burst) for each scope, per blueprint.
+# "ip" buckets are keyed by client address, "user" buckets by the
+# signed-in customer (or admin session) so shared NATs are not punished
+# for a single noisy account.
+BLUEPRINT_LIMITS = {
+    "main": {
+        "ip": (1.0, 20),
+        "user": (0.5, 10),
+    },
+    "admin": {
+        "ip": (5.0, 60),
+        "user": (5.0, 60),
+    },
+}
+
+# Storefront endpoints that go through the buckets. Every admin
+# endpoint is limited.
+LIMITED_ENDPOINTS = {"main.login", "main.place_order"}
+
+# Endpoints that never touch Postgres and skip the concurrency cap
+NON_DB_ENDPOINTS = {
+    "static",
+    "main.offers",
+    "main.faq",
+    "main.contact",
+    "main.blog",
+    "main.about",
+    "main.logout",
+    "admin.admin_logout",
+    # long-lived; fed by the LISTEN thread, not a per-request connection
+    "admin.orders_stream",
+    "admin.admin_profiles",
+    "admin.download_profile",
+}
+
+# Endpoints whose callers expect a JSON body
+JSON_ENDPOINTS = {"main.place_order"}
+
+
+# -----------------------------
+# TOKEN BUCKET STORES
+# -----------------------------
+class MemoryBucketStore:
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        """Take one token; return 0 if allowed, else seconds to wait."""
+        now = time.monotonic()
+
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+
+            if tokens >= 1:
+                self._store(key, tokens - 1, now)
+                return 0
+
+            self._store(key, tokens, now)
+            return (1 - tokens) / rate
+
+    def _store(self, key, tokens, now):
+        if key not in self._buckets and len(self._buckets) >= self.maxsize:
+            # keep only throttled clients; everyone else restarts full
+            self._buckets = {
+                k: v for k, v in self._buckets.items() if v[0] < 1
+            }
+        self._buckets[key] = (tokens, now)
+
+
+class PostgresBucketStore:
+    """Buckets shared by every worker and node through the rate_limits table.
+
+    Each worker keeps one autocommit connection for the limiter, so a burst
+    of requests never opens more than that; lookups take turns on it.
+    """
+
+    def __init__(self):
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        # a connection inherited across fork belongs to the parent
+        if self._conn is None or self._conn.closed or self._pid != os.getpid():
+            self._conn = get_db()
+            self._pid = os.getpid()
+            if self._conn:
+                self._conn.autocommit = True
+        return self._conn
+
+    def _drop(self):
+        try:
+            self._conn.close()
+        except psycopg2.Error:
+            pass
+        self._conn = None
+
+    def take(self, key, rate, burst):
+        with self._lock:
+            conn = self._connection()
+            if not conn:
+                # fail open: the circuit is the DB's problem, not the limiter's
+                return 0
+
+            try:
+                row = self._take(conn, key, rate, burst)
+            except psycopg2.Error as e:
+                # fail open here too, and reconnect on the next request
+                print("RATE LIMIT STORE ERROR:", e)
+                self._drop()
+                return 0
+
+        if row["allowed"]:
+            return 0
+        return (1 - float(row["tokens"])) / rate
+
+    def _take(self, conn, key, rate, burst):
+        refilled = (
+            "LEAST(%(burst)s, r.tokens"
+            " + EXTRACT(EPOCH FROM now() - r.updated_at) * %(rate)s)"
+        )
+
+        cur = conn.cursor()
+        cur.execute(f"""
+            INSERT INTO rate_limits AS r (key, tokens, allowed, updated_at)
+            VALUES (%(key)s, %(burst)s - 1, TRUE, now())
+            ON CONFLICT (key) DO UPDATE SET
+                tokens = CASE WHEN {refilled} >= 1
+                              THEN {refilled} - 1
+                              ELSE {refilled} END,
+                allowed = {refilled} >= 1,
+                updated_at = now()
+            RETURNING tokens, allowed
+        """, {"key": key, "rate": rate, "burst": burst})
+        return cur.fetchone()
+
+
+if RATE_LIMIT_BACKEND == "postgres":
+    bucket_store = PostgresBucketStore()
+else:
+    bucket_store = MemoryBucketStore()
+
+
+# -----------------------------
+# EXPIRED BUCKETS (postgres backend)
+# -----------------------------
+def prune_rate_limits():
+    """Delete buckets idle long enough to have refilled completely."""
+    conn = get_db()
+    if not conn:
+        raise RuntimeError("Database unavailable")
+
+    try:
+        cur = conn.cursor()
+        # the slowest bucket refills within burst / rate seconds
+        refill = max(burst / rate for limits in BLUEPRINT_LIMITS.values()
+                     for rate, burst in limits.values())
+        cur.execute(
+            "DELETE FROM rate_limits WHERE updated_at < now() - make_interval(secs => %s)",
+            (refill,)
+        )
+        deleted = cur.rowcount
+        conn.commit()
+        return deleted
+    finally:
+        conn.close()
+
+
+@jobs.register("prune_rate_limits")
+def prune_rate_limits_job(payload):
+    deleted = prune_rate_limits()
+    if deleted:
+        print("RATE LIMIT BUCKETS PRUNED:", deleted)
+
+
+if RATE_LIMIT_BACKEND == "postgres":
+    jobs.every(RATE_LIMIT_PRUNE_INTERVAL, "prune_rate_limits")
+
+
+# Global cap on in-flight DB-bound requests in this worker
+db_slots = threading.BoundedSemaphore(DB_CONCURRENCY_LIMIT)
+
+
+# -----------------------------
+# HELPERS
+# -----------------------------
+def _client_ip():
+    # ProxyFix (see create_app) already resolved the trusted hop
+    return request.remote_addr or "unknown"
+
+
+def _user_key():
+    if request.blueprint == "admin" and session.get("admin_logged_in"):
+        return "admin"
+    if "user_id" in session:
+        return str(session["user_id"])
+    return None
+
+
+def _reject(status, message, retry_after):
+    retry_after = max(1, int(math.ceil(retry_after)))
+
+    if request.endpoint in JSON_ENDPOINTS:
+        response = jsonify(success=False, message=message)
+    else:
+        response = jsonify(error=message) if request.is_json else message
+
+    return response, status, {"Retry-After": str(retry_after)}
+
+
+def _is_limited():
+    if request.blueprint == "admin":
+        return True
+    return request.endpoint in LIMITED_ENDPOINTS
+
+
+# -----------------------------
+# REQUEST HOOKS
+# -----------------------------
+def check_rate_limits():
+    if not request.endpoint or request.method == "OPTIONS":
+        return None
+
+    limits = BLUEPRINT_LIMITS.get(request.blueprint)
+    if limits and _is_limited():
+        keys = [("ip", _client_ip())]
+        user = _user_key()
+        if user:
+            keys.append(("user", user))
+
+        for scope, ident in keys:
+            rate, burst = limits[scope]
+            wait = bucket_store.take(
+                f"{request.blueprint}:{scope}:{ident}", rate, burst
+            )
+            if wait:
+                return _reject(429, "Too many requests, please retry shortly", wait)
+
+    if request.endpoint not in NON_DB_ENDPOINTS:
+        # shed load instead of queueing behind an exhausted Postgres
+        if not db_slots.acquire(blocking=False):
+            return _reject(503, "Service busy, please retry shortly", 1)
+        g.db_slot = True
+
+    return None
+
+
+def release_db_slot(exc=None):
+    if g.pop("db_slot", False):
+        db_slots.release()
+
+
+def init_rate_limiting(app):
+    if not RATE_LIMIT_ENABLED:
+        return
+
+    if DB_CONCURRENCY_LIMIT >= GUNICORN_THREADS:
+        print(
+            f"WARNING: DB_CONCURRENCY_LIMIT={DB_CONCURRENCY_LIMIT} is not below "
+            f"GUNICORN_THREADS={GUNICORN_THREADS}; the DB cap will never shed load"
+        )
+
+    app.before_request(check_rate_limits)
+    app.teardown_request(release_db_slot)
@@ -0,0 +1,271 @@
+import numpy as np
+from psycopg2.extras import execute_values
+
+from app import jobs
+from app.cache import TTLCache
+from app.catalog import get_product_card
+from app.config import (
+    CATALOG_CACHE_TTL,
+    RECOMMENDATIONS_TOP_K,
+    RECOMMENDATIONS_MIN_SUPPORT,
+    RECOMMENDATIONS_REFRESH_INTERVAL,
+)
+from app.database import get_db
+
+# pg_try_advisory_xact_lock key so only one refresh runs at a time
+RECOMMENDATIONS_LOCK_KEY = 0x5A1E_5001
+
+# orders per counting pass (full rebuild id ranges, queued id batches)
+COUNT_CHUNK_ORDERS = 20000
+
+# bulk orders say little about what goes together and cost size**2 pairs
+MAX_ORDER_PRODUCTS = 50
+
+# product_id -> [(recommended_id, score)] best first
+recommendation_cache = TTLCache(ttl=CATALOG_CACHE_TTL, maxsize=2048)
+
+
+# -----------------------------
+# CHANGE TRACKING
+# -----------------------------
+def queue_order_for_recommendations(cur, order_id):
+    """Call inside the transaction that places the order."""
+    cur.execute("INSERT INTO recommendation_queue (order_id) VALUES (%s)", (order_id,))
+
+
+# -----------------------------
+# COUNTING (vectorized)
+# -----------------------------
+def count_pairs(order_ids, product_ids):
+    """Co-purchase counts from parallel order_id / product_id arrays.
+
+    Returns (products, product_orders, pair_a, pair_b, pair_orders): the
+    number of orders containing each product and, for every pair a < b
+    bought together, the number of orders containing both.
+    """
+    lines = np.unique(np.column_stack([order_ids, product_ids]).astype(np.int64), axis=0)
+    products, product_index = np.unique(lines[:, 1], return_inverse=True)
+    product_orders = np.bincount(product_index, minlength=len(products))
+
+    # lines are sorted by (order, product): each order is one run
+    _, start, size = np.unique(lines[:, 0], return_index=True, return_counts=True)
+    keep = (size > 1) & (size <= MAX_ORDER_PRODUCTS)
+    start, size = start[keep], size[keep]
+
+    # every (i, j) position pair inside each run; i < j gives a < b
+    cells = size ** 2
+    run = np.repeat(np.arange(len(size)), cells)
+    cell = np.arange(cells.sum()) - np.repeat(np.cumsum(cells) - cells, cells)
+    i, j = cell // size[run], cell % size[run]
+    upper = i < j
+    first = start[run[upper]]
+    a = product_index[first + i[upper]].astype(np.int64)
+    b = product_index[first + j[upper]].astype(np.int64)
+
+    n = len(products)
+    keys, pair_orders = np.unique(a * n + b, return_counts=True)
+    return products, product_orders, products[keys // n], products[keys % n], pair_orders
+
+
+def _load_lines(cur, where, params):
+    cur.execute(f"""
+        SELECT i.order_id, i.product_id
+        FROM order_items i
+        JOIN orders o ON o.id = i.order_id
+        WHERE o.status <> 'CANCELLED' AND {where}
+    """, params)
+    rows = cur.fetchall()
+    return (
+        np.array([r["order_id"] for r in rows], dtype=np.int64),
+        np.array([r["product_id"] for r in rows], dtype=np.int64),
+    )
+
+
+def _add_counts(cur, order_ids, product_ids):
+    """Fold a batch of order lines into the count tables; touched product ids."""
+    if not len(order_ids):
+        return set()
+
+    products, product_orders, a, b, pair_orders = count_pairs(order_ids, product_ids)
+
+    execute_values(cur, """
+        INSERT INTO product_order_counts (product_id, orders) VALUES %s
+        ON CONFLICT (product_id)
+        DO UPDATE SET orders = product_order_counts.orders + EXCLUDED.orders
+    """, list(zip(products.tolist(), product_orders.tolist())), page_size=1000)
+
+    pairs = list(zip(a.tolist(), b.tolist(), pair_orders.tolist()))
+    if pairs:
+        execute_values(cur, """
+            INSERT INTO product_cooccurrence (product_id, other_id, orders) VALUES %s
+            ON CONFLICT (product_id, other_id)
+            DO UPDATE SET orders = product_cooccurrence.orders + EXCLUDED.orders
+        """, pairs + [(other, pid, n) for pid, other, n in pairs], page_size=1000)
+
+    return set(products.tolist())
+
+
+def _rebuild_top_k(cur, product_ids=None):
+    """Re-rank neighbours by co-purchases / sqrt(orders_a * orders_b)."""
+    params = {
+        "ids": product_ids,
+        "k": RECOMMENDATIONS_TOP_K,
+        "support": RECOMMENDATIONS_MIN_SUPPORT,
+    }
+    cur.execute("""
+        DELETE FROM product_recommendations
+        WHERE %(ids)s::int[] IS NULL OR product_id = ANY(%(ids)s::int[])
+    """, params)
+    cur.execute("""
+        INSERT INTO product_recommendations (product_id, rank, recommended_id, score)
+        SELECT product_id, rank, other_id, score
+        FROM (
+            SELECT c.product_id, c.other_id, s.score,
+                   row_number() OVER (
+                       PARTITION BY c.product_id ORDER BY s.score DESC, c.other_id
+                   ) AS rank
+            FROM product_cooccurrence c
+            JOIN product_order_counts a ON a.product_id = c.product_id
+            JOIN product_order_counts b ON b.product_id = c.other_id
+            CROSS JOIN LATERAL (
+                SELECT c.orders / sqrt(a.orders::float8 * b.orders) AS score
+            ) s
+            WHERE c.orders >= %(support)s
+              AND (%(ids)s::int[] IS NULL OR c.product_id = ANY(%(ids)s::int[]))
+        ) ranked
+        WHERE rank <= %(k)s
+    """, params)
+
+
+# -----------------------------
+# REFRESH
+# -----------------------------
+def refresh_recommendations(full=False):
+    """Fold queued orders into the co-purchase counts and re-rank.
+
+    The first run (or ``full``) rebuilds the counts from every live order;
+    archived orders only survive in counts built before they were archived.
+    Orders cancelled after being counted stay counted until a full rebuild.
+    Returns the number of orders counted, or None if another refresh holds
+    the lock.
+    """
+    conn = get_db()
+    if not conn:
+        raise RuntimeError("Database unavailable")
+
+    try:
+        # one snapshot, so an order is counted by the full scan or by its
+        # queue row, never both
+        conn.set_session(isolation_level="REPEATABLE READ")
+        cur = conn.cursor()
+        cur.execute("SELECT pg_try_advisory_xact_lock(%s) AS ok", (RECOMMENDATIONS_LOCK_KEY,))
+        if not cur.fetchone()["ok"]:
+            return None
+
+        cur.execute("DELETE FROM recommendation_queue RETURNING order_id")
+        queued = sorted({r["order_id"] for r in cur.fetchall()})
+
+        cur.execute("SELECT 1 FROM report_state WHERE name = 'recommendations'")
+        if cur.fetchone() is None:
+            full = True
+
+        if full:
+            cur.execute("TRUNCATE product_order_counts, product_cooccurrence")
+            cur.execute("SELECT min(id) AS lo, max(id) AS hi, count(*) AS n FROM orders")
+            bounds = cur.fetchone()
+            counted = bounds["n"]
+            if bounds["lo"] is not None:
+                for lo in range(bounds["lo"], bounds["hi"] + 1, COUNT_CHUNK_ORDERS):
+                    _add_counts(cur, *_load_lines(
+                        cur, "i.order_id BETWEEN %s AND %s", (lo, lo + COUNT_CHUNK_ORDERS - 1)
+                    ))
+            _rebuild_top_k(cur)
+        else:
+            counted = len(queued)
+            touched = set()
+            for k in range(0, len(queued), COUNT_CHUNK_ORDERS):
+                touched |= _add_counts(cur, *_load_lines(
+                    cur, "i.order_id = ANY(%s)", (queued[k:k + COUNT_CHUNK_ORDERS],)
+                ))
+
+            if touched:
+                # a neighbour's order count is part of every score it appears in
+                cur.execute(
+                    "SELECT DISTINCT product_id FROM product_cooccurrence WHERE other_id = ANY(%s)",
+                    (list(touched),)
+                )
+                touched.update(r["product_id"] for r in cur.fetchall())
+                _rebuild_top_k(cur, sorted(touched))
+
+        cur.execute("""
+            INSERT INTO report_state (name, refreshed_at) VALUES ('recommendations', now())
+            ON CONFLICT (name) DO UPDATE SET refreshed_at = EXCLUDED.refreshed_at
+        """)
+        conn.commit()
+        return counted
+    finally:
+        conn.close()
+
+
+@jobs.register("refresh_recommendations")
+def refresh_recommendations_job(payload):
+    counted = refresh_recommendations()
+    if counted:
+        print("RECOMMENDATIONS REFRESHED:", counted, "order(s)")
+
+
+jobs.every(RECOMMENDATIONS_REFRESH_INTERVAL, "refresh_recommendations")
+
+
+# -----------------------------
+# READ SIDE (product_detail, cart)
+# -----------------------------
+def load_recommendations(product_ids, limit=4):
+    """In-stock product cards bought together with ``product_ids``, best first."""
+    product_ids = list(dict.fromkeys(product_ids))
+
+    neighbours, missing = {}, []
+    for product_id in product_ids:
+        cached = recommendation_cache.get(product_id)
+        if cached is None:
+            missing.append(product_id)
+        else:
+            neighbours[product_id] = cached
+
+    if missing:
+        conn = get_db()
+        if conn:
+            try:
+                cur = conn.cursor()
+                # primary key range scan per product
+                cur.execute("""
+                    SELECT product_id, recommended_id, score
+                    FROM product_recommendations
+                    WHERE product_id = ANY(%s)
+                    ORDER BY product_id, rank
+                """, (missing,))
+                fetched = {product_id: [] for product_id in missing}
+                for r in cur.fetchall():
+                    fetched[r["product_id"]].append((r["recommended_id"], r["score"]))
+            finally:
+                conn.close()
+
+            for product_id, recs in fetched.items():
+                recommendation_cache.set(product_id, recs)
+                neighbours[product_id] = recs
+
+    # a cart merges its products' lists, keeping each product's best score
+    best = {}
+    for recs in neighbours.values():
+        for recommended_id, score in recs:
+            if recommended_id not in product_ids and score > best.get(recommended_id, 0):
+                best[recommended_id] = score
+
+    cards = []
+    for recommended_id in sorted(best, key=best.get, reverse=True):
+        card = get_product_card(recommended_id)
+        if card and card.stock > 0:
+            cards.append(card)
+            if len(cards) == limit:
+                break
+    return cards
@@ -0,0 +1,201 @@
+from datetime import date, timedelta
+
+from app import jobs
+from app.config import REPORTS_REFRESH_INTERVAL
+from app.database import get_db
+from app.models import to_paise
+
+# pg_try_advisory_xact_lock key so only one refresh runs at a time
+REPORTS_LOCK_KEY = 0x5A1E_5000
+
+REPORT_RANGES = (7, 30, 90, 365)
+
+# longer ranges chart weekly buckets instead of one bar per day
+DAILY_SERIES_MAX_DAYS = 90
+
+UNCATEGORISED = "Uncategorised"
+
+
+# -----------------------------
+# CHANGE TRACKING
+# -----------------------------
+def mark_order_changed(cur, order_id, created_at):
+    """Queue the order's day for the next refresh.
+
+    Call inside the transaction that inserts, updates or deletes the order:
+    the refresh only sees the mark once that write has committed.
+    """
+    if created_at is None:
+        return
+    cur.execute(
+        "INSERT INTO report_queue (order_id, day) VALUES (%s, %s::date)",
+        (order_id, created_at)
+    )
+
+
+# -----------------------------
+# REFRESH
+# -----------------------------
+def _recompute_days(cur, days):
+    cur.execute("DELETE FROM sales_daily_product WHERE day = ANY(%s)", (days,))
+
+    # one index range scan on orders.created_at per day
+    cur.execute("""
+        INSERT INTO sales_daily_product
+            (day, product_id, name, category, orders, units, revenue)
+        SELECT d.day, i.product_id, max(i.name),
+               COALESCE(max(p.category), %s),
+               count(DISTINCT o.id), sum(i.quantity), sum(i.price * i.quantity)
+        FROM unnest(%s::date[]) AS d(day)
+        JOIN orders o
+          ON o.created_at >= d.day AND o.created_at < d.day + 1
+        JOIN order_items i ON i.order_id = o.id
+        LEFT JOIN products p ON p.id = i.product_id
+        WHERE o.status <> 'CANCELLED'
+        GROUP BY d.day, i.product_id
+    """, (UNCATEGORISED, days))
+
+
+def _recompute_weeks(cur, days):
+    weeks = sorted({d - timedelta(days=d.weekday()) for d in days})
+    cur.execute("DELETE FROM sales_weekly_category WHERE week = ANY(%s)", (weeks,))
+    cur.execute("""
+        INSERT INTO sales_weekly_category (week, category, units, revenue)
+        SELECT w.week, s.category, sum(s.units), sum(s.revenue)
+        FROM unnest(%s::date[]) AS w(week)
+        JOIN sales_daily_product s
+          ON s.day >= w.week AND s.day < w.week + 7
+        GROUP BY w.week, s.category
+    """, (weeks,))
+
+
+def refresh_sales_reports():
+    """Rebuild the summary rows for every day with queued order changes.
+
+    The first run backfills every day that has orders. Returns the number
+    of days recomputed, or None if another refresh holds the lock.
+    """
+    conn = get_db()
+    if not conn:
+        raise RuntimeError("Database unavailable")
+
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT pg_try_advisory_xact_lock(%s) AS ok", (REPORTS_LOCK_KEY,))
+        if not cur.fetchone()["ok"]:
+            return None
+
+        # marks from uncommitted order writes stay queued for the next run
+        cur.execute("DELETE FROM report_queue RETURNING day")
+        days = {r["day"] for r in cur.fetchall()}
+
+        cur.execute("SELECT 1 FROM report_state WHERE name = 'sales'")
+        if cur.fetchone() is None:
+            cur.execute("""
+                SELECT DISTINCT created_at::date AS day
+                FROM orders WHERE created_at IS NOT NULL
+            """)
+            days.update(r["day"] for r in cur.fetchall())
+
+        days = sorted(days)
+        if days:
+            _recompute_days(cur, days)
+            _recompute_weeks(cur, days)
+
+        cur.execute("""
+            INSERT INTO report_state (name, refreshed_at) VALUES ('sales', now())
+            ON CONFLICT (name) DO UPDATE SET refreshed_at = EXCLUDED.refreshed_at
+        """)
+        conn.commit()
+        return len(days)
+    finally:
+        conn.close()
+
+
+@jobs.register("refresh_sales_reports")
+def refresh_sales_reports_job(payload):
+    days = refresh_sales_reports()
+    if days:
+        print("SALES REPORTS REFRESHED:", days, "day(s)")
+
+
+jobs.every(REPORTS_REFRESH_INTERVAL, "refresh_sales_reports")
+
+
+# -----------------------------
+# READ SIDE (admin /reports)
+# -----------------------------
+def _with_paise(rows):
+    for r in rows:
+        r["revenue_paise"] = to_paise(r.pop("revenue"))
+    return rows
+
+
+def load_sales_report(days):
+    """Revenue series, top products and category mix for the last ``days`` days."""
+    start = date.today() - timedelta(days=days - 1)
+    conn = get_db()
+    if not conn:
+        return None
+
+    try:
+        cur = conn.cursor()
+
+        if days <= DAILY_SERIES_MAX_DAYS:
+            cur.execute("""
+                SELECT day AS bucket, sum(units) AS units, sum(revenue) AS revenue
+                FROM sales_daily_product
+                WHERE day >= %s
+                GROUP BY day ORDER BY day
+            """, (start,))
+        else:
+            cur.execute("""
+                SELECT week AS bucket, sum(units) AS units, sum(revenue) AS revenue
+                FROM sales_weekly_category
+                WHERE week >= %s
+                GROUP BY week ORDER BY week
+            """, (start - timedelta(days=start.weekday()),))
+        series = _with_paise(cur.fetchall())
+
+        cur.execute("""
+            SELECT product_id, max(name) AS name, max(category) AS category,
+                   sum(orders) AS orders, sum(units) AS units, sum(revenue) AS revenue
+            FROM sales_daily_product
+            WHERE day >= %s
+            GROUP BY product_id
+            ORDER BY sum(revenue) DESC
+            LIMIT 20
+        """, (start,))
+        products = _with_paise(cur.fetchall())
+
+        cur.execute("""
+            SELECT category, sum(units) AS units, sum(revenue) AS revenue
+            FROM sales_daily_product
+            WHERE day >= %s
+            GROUP BY category
+            ORDER BY sum(revenue) DESC
+        """, (start,))
+        categories = _with_paise(cur.fetchall())
+
+        cur.execute("""
+            SELECT (SELECT refreshed_at FROM report_state WHERE name = 'sales') AS refreshed_at,
+                   (SELECT count(*) FROM report_queue) AS pending
+        """)
+        state = cur.fetchone()
+    finally:
+        conn.close()
+
+    total_paise = sum(r["revenue_paise"] for r in categories)
+    return {
+        "days": days,
+        "daily": days <= DAILY_SERIES_MAX_DAYS,
+        "series": series,
+        "series_max": max((r["revenue_paise"] for r in series), default=0),
+        "products": products,
+        "products_max": max((r["revenue_paise"] for r in products), default=0),
+        "categories": categories,
+        "total_paise": total_paise,
+        "units": sum(r["units"] for r in categories),
+        "refreshed_at": state["refreshed_at"],
+        "pending": state["pending"],
+    }
@@ -1,10 +1,40 @@
 from flask import Blueprint, render_template, session, redirect, url_for, request, jsonify
-from app.database import get_db
+from app.database import get_db, db_available
+from app import jobs, listener
+from app.catalog import (
+    load_product_cards,
+    get_product_card,
+    load_product,
+    load_category_facets,
+)
+from app.models import to_paise, rupees, to_decimal, cart_total_paise, parse_coordinates
+from app.reports import mark_order_changed
+from app.order_feed import notify_order_changed
+from app.stock import reserve_cart, convert_holds, load_availability, fold_sold_stock
+from app.recommendations import load_recommendations, queue_order_for_recommendations
+from app.order_history import load_order_history, invalidate_order_history
+from app.cache import TTLCache
+from app.config import USER_CACHE_TTL, STOCK_HOLD_TTL
 from datetime import datetime
 from functools import wraps
 
 main = Blueprint("main", __name__)
 
+# phone -> {"id", "name"} for users who recently signed in on this worker
+user_cache = TTLCache(ttl=USER_CACHE_TTL, maxsize=4096)
+
+USERS_CHANNEL = "users_changed"
+
+
+def invalidate_users(phones):
+    for phone in phones:
+        if phone:
+            user_cache.pop(phone)
+
+
+# account updates on other workers
+listener.subscribe(USERS_CHANNEL, lambda payload: invalidate_users(payload.get("phones", [])))
+
 
 # -----------------------
 # HELPERS
@@ -18,28 +48,22 @@ def login_required(view):
     return wrapped
 
 
-def _get_product_image(product):
-    images = product.get("images") or []
-    return images[0] if images else "default.png"
-
-
-def load_products():
-    conn = get_db()
-    if not conn:
-        return []
-
-    try:
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM products ORDER BY id DESC")
-        products = cur.fetchall()
+def _get_cart():
+    cart = session.get("cart", [])
+    for item in cart:
+        # carts saved before prices moved to integer paise
+        if "price_paise" not in item:
+            item["price_paise"] = to_paise(item.pop("price", 0))
+    return cart
 
-        for p in products:
-            p["images"] = p["images"] or []
-            p["badges"] = p["badges"] or []
 
-        return products
-    finally:
-        conn.close()
+# -----------------------
+# BACKGROUND JOBS
+# -----------------------
+@jobs.register("order_placed")
+def on_order_placed(payload):
+    print("NEW ORDER:", payload["order_id"], "TOTAL:", rupees(payload["total_paise"]))
+    fold_sold_stock()
 
 
 # -----------------------
@@ -55,32 +79,35 @@ def login():
         if not phone:
             return render_template("login.html", error="Phone number required")
 
-        conn = get_db()
-        if not conn:
-            return render_template("login.html", error="Service unavailable")
+        # Session already proves this phone belongs to the signed-in user
+        user = user_cache.get(phone)
+        if not user or session.get("user_id") != user["id"]:
+            conn = get_db()
+            if not conn:
+                return render_template("login.html", error="Service unavailable")
 
-        try:
-            cur = conn.cursor()
-            cur.execute("SELECT * FROM users WHERE phone = %s", (phone,))
-            user = cur.fetchone()
-
-            # NEW USER → AUTO CREATE
-            if not user:
-                cur.execute(
-                    "INSERT INTO users (name, phone, created_at) VALUES (%s, %s, %s)",
-                    (name or "Customer", phone, datetime.now())
-                )
+            try:
+                cur = conn.cursor()
+                # NEW USER → AUTO CREATE (existing users keep their name)
+                cur.execute("""
+                    INSERT INTO users (name, phone, created_at)
+                    VALUES (%s, %s, %s)
+                    ON CONFLICT (phone) DO UPDATE SET phone = EXCLUDED.phone
+                    RETURNING id, name
+                """, (name or "Customer", phone, datetime.now()))
+                row = cur.fetchone()
                 conn.commit()
+            finally:
+                conn.close()
 
-                cur.execute("SELECT * FROM users WHERE phone = %s", (phone,))
-                user = cur.fetchone()
+            user = {"id": row["id"], "name": row["name"]}
+            user_cache.set(phone, user)
 
-            session["user_id"] = user["id"]
-            session["user_name"] = user["name"]
+        session["user_id"] = user["id"]
+        session["user_name"] = user["name"]
+        session["user_phone"] = phone
 
-            return redirect(url_for("main.home"))
-        finally:
-            conn.close()
+        return redirect(url_for("main.home"))
 
     return render_template("login.html")
 
@@ -103,21 +130,9 @@ def account():
 @main.route("/account/orders")
 @login_required
 def my_orders():
-    conn = get_db()
-    if not conn:
-        return render_template("my_orders.html", orders=[])
-
-    try:
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT id, total, status, created_at FROM orders WHERE user_id = %s ORDER BY id DESC",
-            (session["user_id"],)
-        )
-        orders = cur.fetchall()
-
-        return render_template("my_orders.html", orders=orders)
-    finally:
-        conn.close()
+    # cached per user until one of their orders changes
+    orders = load_order_history(session["user_id"])
+    return render_template("my_orders.html", orders=orders or [])
 
 
 # Account Update
@@ -141,9 +156,14 @@ def update_account():
             "UPDATE users SET name = %s, phone = %s WHERE id = %s",
             (name, phone, session["user_id"])
         )
+        phones = [session.get("user_phone"), phone]
+        listener.notify(cur, USERS_CHANNEL, {"phones": phones})
         conn.commit()
 
+        invalidate_users(phones)
+
         session["user_name"] = name
+        session["user_phone"] = phone
         return redirect(url_for("main.account"))
     finally:
         conn.close()
@@ -154,11 +174,8 @@ def update_account():
 # -----------------------
 @main.route("/")
 def home():
-    products = load_products()
-
-    categories = sorted(
-        set(p["category"] for p in products if p.get("category"))
-    )
+    products = load_product_cards()
+    categories = load_category_facets()
 
     return render_template(
         "index.html",
@@ -171,23 +188,24 @@ def home():
 # -----------------------
 @main.route("/products")
 def products():
-    products = load_products()
-    categories = sorted(set(p["category"] for p in products if p.get("category")))
-
     selected_category = request.args.get("category")
-    if selected_category:
-        products = [p for p in products if p["category"] == selected_category]
+    products = load_product_cards(selected_category)
+    categories = load_category_facets()
 
     return render_template("products.html", products=products, categories=categories, selected_category=selected_category)
 
 
 @main.route("/product/<int:product_id>")
 def product_detail(product_id):
-    products = load_products()
-    product = next((p for p in products if p["id"] == product_id), None)
+    product = load_product(product_id)
     if not product:
         return "Product not found", 404
-    return render_template("product_detail.html", product=product)
+
+    return render_template(
+        "product_detail.html",
+        product=product,
+        recommendations=load_recommendations([product_id])
+    )
 
 
 # -----------------------
@@ -195,25 +213,18 @@ def product_detail(product_id):
 # -----------------------
 @main.route("/add_to_cart/<int:product_id>")
 def add_to_cart(product_id):
-    products = load_products()
-    product = next((p for p in products if p["id"] == product_id), None)
+    product = get_product_card(product_id)
 
-    if not product or product["stock"] <= 0:
+    if not product or product.stock <= 0:
         return "Out of stock", 400
 
-    cart = session.get("cart", [])
+    cart = _get_cart()
     item = next((i for i in cart if i["id"] == product_id), None)
 
     if item:
         item["quantity"] += 1
     else:
-        cart.append({
-            "id": product["id"],
-            "name": product["name"],
-            "price": float(product["price"]),
-            "image": _get_product_image(product),
-            "quantity": 1
-        })
+        cart.append(product.to_cart_item())
 
     session["cart"] = cart
     return redirect(url_for("main.view_cart"))
@@ -221,28 +232,27 @@ def add_to_cart(product_id):
 
 @main.route("/cart")
 def view_cart():
-    cart = session.get("cart", [])
-    products = load_products()
-    total = 0
-    for item in cart:
-        product = next((p for p in products if p["id"] == item["id"]), None)
-        if product:
-            total += float(product["price"]) * item["quantity"]
+    cart = _get_cart()
+    total = cart_total_paise(cart, get_product_card)
+    recommendations = load_recommendations([item["id"] for item in cart]) if cart else []
 
-    return render_template("cart.html", cart=cart, total=total)
+    return render_template(
+        "cart.html",
+        cart=cart,
+        total=rupees(total),
+        recommendations=recommendations
+    )
 
 
 @main.route("/cart/increase/<int:product_id>")
 def increase_quantity(product_id):
-    cart = session.get("cart", [])
-    products = load_products()
-
-    product = next((p for p in products if p["id"] == product_id), None)
+    cart = _get_cart()
+    product = get_product_card(product_id)
     if not product:
         return redirect(url_for("main.view_cart"))
 
     for item in cart:
-        if item["id"] == product_id and item["quantity"] < product["stock"]:
+        if item["id"] == product_id and item["quantity"] < product.stock:
             item["quantity"] += 1
             break
 
@@ -253,7 +263,7 @@ def increase_quantity(product_id):
 
 @main.route("/cart/decrease/<int:product_id>")
 def decrease_quantity(product_id):
-    cart = session.get("cart", [])
+    cart = _get_cart()
 
     for item in cart:
         if item["id"] == product_id and item["quantity"] > 1:
@@ -266,7 +276,7 @@ def decrease_quantity(product_id):
 
 @main.route("/cart/remove/<int:product_id>")
 def remove_from_cart(product_id):
-    cart = session.get("cart", [])
+    cart = _get_cart()
     session["cart"] = [i for i in cart if i["id"] != product_id]
     return redirect(url_for("main.view_cart"))
 
@@ -278,27 +288,45 @@ def remove_from_cart(product_id):
 @main.route("/checkout")
 @login_required
 def checkout():
-    cart = session.get("cart", [])
+    cart = _get_cart()
     if not cart:
         return redirect(url_for("main.view_cart"))
 
-    products = load_products()
-    total = 0
-    for item in cart:
-        product = next((p for p in products if p["id"] == item["id"]), None)
-        if product:
-            total += float(product["price"]) * item["quantity"]
+    total = cart_total_paise(cart, get_product_card)
+
+    # hold the cart's stock while the customer fills in the form
+    short = reserve_cart(session["user_id"], cart) if db_available() else None
+    if short:
+        available = load_availability(short)
+        short = [
+            {"name": item["name"], "available": available.get(item["id"], 0)}
+            for item in cart if item["id"] in short
+        ]
 
-    return render_template("checkout.html", cart=cart, total=total)
+    # catalog may be a snapshot; don't take orders we cannot store
+    return render_template(
+        "checkout.html",
+        cart=cart,
+        total=rupees(total),
+        checkout_unavailable=short is None,
+        short_items=short or [],
+        hold_minutes=STOCK_HOLD_TTL // 60
+    )
 
 
 @main.route("/place_order", methods=["POST"])
 @login_required
 def place_order():
-    cart = session.get("cart", [])
+    cart = _get_cart()
     if not cart:
         return jsonify(success=False, message="Cart is empty"), 400
 
+    if not db_available():
+        return jsonify(
+            success=False,
+            message="Ordering is temporarily unavailable. Your cart is saved, please try again in a few minutes."
+        ), 503, {"Retry-After": "30"}
+
     try:
         name = request.form.get("name")
         phone = request.form.get("phone")
@@ -311,15 +339,21 @@ def place_order():
         if not all([name, phone, address, payment_method, latitude, longitude]):
             return jsonify(success=False, message="Missing required fields"), 400
 
+        coords = parse_coordinates(latitude, longitude)
+        if coords is None:
+            return jsonify(success=False, message="Invalid delivery location"), 400
+
         map_link = f"https://maps.google.com/?q={latitude},{longitude}"
         
-        products = load_products()
-        total = 0
+        # stock itself is checked against the checkout holds below
+        products = {}
         for item in cart:
-            product = next((p for p in products if p["id"] == item["id"]), None)
-            if not product or item["quantity"] > product["stock"]:
+            product = get_product_card(item["id"])
+            if not product:
                 return jsonify(success=False, message="Stock changed"), 400
-            total += float(product["price"]) * item["quantity"]
+            products[item["id"]] = product
+
+        total = cart_total_paise(cart, products.get)
 
         conn = get_db()
         if not conn:
@@ -331,9 +365,9 @@ def place_order():
             cur.execute("""
                 INSERT INTO orders
                 (user_id, name, phone, address, landmark, payment_method,
-                 latitude, longitude, map_link, total, status, created_at)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                RETURNING id
+                 latitude, longitude, lat, lng, map_link, total, status, created_at)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                RETURNING id, user_id, name, phone, total, status, created_at
             """, (
                 session["user_id"],
                 name,
@@ -343,32 +377,53 @@ def place_order():
                 payment_method,
                 latitude,
                 longitude,
+                coords[0],
+                coords[1],
                 map_link,
-                total,
+                to_decimal(total),
                 "PENDING",
                 datetime.now()
             ))
 
-            order_id = cur.fetchone()["id"]
+            order = cur.fetchone()
+            order_id = order["id"]
 
             for item in cart:
-                product = next((p for p in products if p["id"] == item["id"]), None)
-                price = float(product["price"])
-                
+                price = to_decimal(products[item["id"]].price_paise)
+
                 cur.execute("""
                     INSERT INTO order_items
-                    (order_id, product_id, name, price, quantity)
-                    VALUES (%s, %s, %s, %s, %s)
+                    (order_id, order_created_at, product_id, name, price, quantity)
+                    VALUES (%s, %s, %s, %s, %s, %s)
                 """, (
                     order_id,
+                    order["created_at"],
                     item["id"],
                     item["name"],
                     price,
                     item["quantity"]
                 ))
 
+            # sold units land on the stock shards; the order_placed job
+            # folds them into products.stock and refreshes the catalog
+            if not convert_holds(cur, session["user_id"], cart):
+                conn.rollback()
+                return jsonify(success=False, message="Stock changed"), 400
+
+            mark_order_changed(cur, order_id, order["created_at"])
+            queue_order_for_recommendations(cur, order_id)
+            notify_order_changed(cur, "placed", order)
+
+            jobs.enqueue("order_placed", {
+                "order_id": order_id,
+                "user_id": session["user_id"],
+                "total_paise": total,
+            }, conn=conn)
+
             conn.commit()
 
+            invalidate_order_history(session["user_id"])
+
             session["cart"] = []
 
             return jsonify(
@@ -380,8 +435,11 @@ def place_order():
                     "address": address,
                     "landmark": landmark,
                     "payment_method": payment_method,
-                    "items": cart,
-                    "total": total,
+                    "items": [
+                        {**item, "price": rupees(item["price_paise"])}
+                        for item in cart
+                    ],
+                    "total": rupees(total),
                     "map_link": map_link
                 }
             )
@@ -428,18 +486,11 @@ def about():
 @main.route("/buy_now/<int:product_id>")
 @login_required
 def buy_now(product_id):
-    products = load_products()
-    product = next((p for p in products if p["id"] == product_id), None)
+    product = get_product_card(product_id)
 
-    if not product or product["stock"] <= 0:
+    if not product or product.stock <= 0:
         return "Product out of stock", 400
 
-    session["cart"] = [{
-        "id": product["id"],
-        "name": product["name"],
-        "price": float(product["price"]),
-        "image": _get_product_image(product),
-        "quantity": 1
-    }]
+    session["cart"] = [product.to_cart_item()]
 
     return redirect(url_for("main.checkout"))
\ No newline at end of file
@@ -0,0 +1,177 @@
+// Live admin order feed: listens on /admin/orders/stream (Server-Sent Events)
+// and updates the dashboard KPIs and "Latest orders" rows in place.
+(function () {
+    const tbody = document.getElementById('recentOrders');
+    const statusBadge = document.getElementById('liveStatus');
+    if (!tbody || !window.EventSource) {
+        return;
+    }
+
+    const limit = parseInt(tbody.dataset.limit, 10) || 20;
+    let source = null;
+    let connectedBefore = false;
+
+    function rupees(paise) {
+        return '₹' + String(paise / 100);
+    }
+
+    function setStatus(text, live) {
+        if (!statusBadge) return;
+        statusBadge.textContent = text;
+        statusBadge.classList.toggle('live', live);
+    }
+
+    // -----------------------------
+    // KPIs
+    // -----------------------------
+    function kpi(name) {
+        return document.querySelector('[data-kpi="' + name + '"]');
+    }
+
+    function setKpi(name, value) {
+        const el = kpi(name);
+        if (!el) return;
+        el.dataset.value = value;
+        el.textContent = name.endsWith('_paise') ? rupees(value) : value;
+    }
+
+    function addKpi(name, delta) {
+        const el = kpi(name);
+        if (!el || !delta) return;
+        setKpi(name, (parseInt(el.dataset.value, 10) || 0) + delta);
+    }
+
+    // -----------------------------
+    // ROWS
+    // -----------------------------
+    function cell(tr, text) {
+        const td = document.createElement('td');
+        td.textContent = text;
+        tr.appendChild(td);
+        return td;
+    }
+
+    function statusCell(tr, status) {
+        const td = document.createElement('td');
+        const span = document.createElement('span');
+        span.className = 'status ' + String(status).toLowerCase();
+        span.textContent = status;
+        td.appendChild(span);
+        tr.appendChild(td);
+    }
+
+    function buildRow(order) {
+        const tr = document.createElement('tr');
+        tr.dataset.orderId = order.id;
+
+        const link = document.createElement('a');
+        link.href = '/admin/order/' + order.id;
+        link.textContent = '#' + order.id;
+        cell(tr, '').appendChild(link);
+
+        cell(tr, order.name);
+        cell(tr, order.phone);
+        cell(tr, rupees(order.total_paise));
+        statusCell(tr, order.status);
+        return tr;
+    }
+
+    function findRow(id) {
+        return tbody.querySelector('tr[data-order-id="' + id + '"]');
+    }
+
+    function prependRow(order) {
+        if (findRow(order.id)) return;
+        const tr = buildRow(order);
+        tr.classList.add('fresh');
+        tbody.insertBefore(tr, tbody.firstChild);
+        while (tbody.children.length > limit) {
+            tbody.removeChild(tbody.lastChild);
+        }
+    }
+
+    // -----------------------------
+    // EVENTS
+    // -----------------------------
+    function apply(event) {
+        const row = findRow(event.id);
+
+        if (event.event === 'placed') {
+            if (row) return;
+            prependRow(event);
+            addKpi('total_orders', 1);
+            addKpi('total_revenue_paise', event.total_paise);
+            if (event.status === 'DELIVERED') addKpi('delivered_orders', 1);
+        } else if (event.event === 'status') {
+            if (row) {
+                row.replaceChild(buildRow(event).lastChild, row.lastChild);
+                row.classList.remove('fresh');
+                void row.offsetWidth;
+                row.classList.add('fresh');
+            }
+            if (event.old_status !== 'DELIVERED' && event.status === 'DELIVERED') addKpi('delivered_orders', 1);
+            if (event.old_status === 'DELIVERED' && event.status !== 'DELIVERED') addKpi('delivered_orders', -1);
+        } else if (event.event === 'deleted') {
+            if (row) row.remove();
+            addKpi('total_orders', -1);
+            addKpi('total_revenue_paise', -event.total_paise);
+            if (event.status === 'DELIVERED') addKpi('delivered_orders', -1);
+        }
+    }
+
+    // after a reconnect or a dropped stream, events may have been missed
+    function resync() {
+        fetch('/admin/orders/summary', { credentials: 'same-origin' })
+            .then(function (r) { return r.ok ? r.json() : null; })
+            .then(function (summary) {
+                if (!summary) return;
+                setKpi('total_orders', summary.total_orders);
+                setKpi('delivered_orders', summary.delivered_orders);
+                setKpi('total_revenue_paise', summary.total_revenue_paise);
+
+                tbody.textContent = '';
+                summary.recent.forEach(function (order) {
+                    tbody.appendChild(buildRow(order));
+                });
+            })
+            .catch(function () {});
+    }
+
+    function connect() {
+        source = new EventSource('/admin/orders/stream');
+
+        source.addEventListener('hello', function () {
+            setStatus('Live', true);
+            if (connectedBefore) resync();
+            connectedBefore = true;
+        });
+
+        source.addEventListener('order', function (e) {
+            apply(JSON.parse(e.data));
+        });
+
+        source.addEventListener('reset', resync);
+
+        source.onerror = function () {
+            setStatus('Reconnecting…', false);
+            // the browser retries on its own unless the server refused (503)
+            if (source.readyState === EventSource.CLOSED) {
+                setTimeout(connect, 30000);
+            }
+        };
+    }
+
+    document.addEventListener('visibilitychange', function () {
+        // don't hold a server thread for a hidden tab
+        if (document.hidden && source) {
+            source.close();
+            source = null;
+            setStatus('Paused', false);
+        } else if (!document.hidden && !source) {
+            connectedBefore = true;
+            connect();
+        }
+    });
+
+    connect();
+})();
@@ -0,0 +1,120 @@
+import hashlib
+import mimetypes
+import os
+import threading
+
+from flask import Response, abort, current_app, request, send_file
+from werkzeug.security import safe_join
+
+from app.storage import get_storage, PARTIAL_SUFFIX
+
+from app.config import (
+    STATIC_SERVE_MODE,
+    STATIC_ACCEL_PREFIX,
+    UPLOADS_ACCEL_PREFIX,
+    STATIC_MAX_AGE,
+    STATIC_SMALL_ASSET_MAX,
+    STATIC_MEMORY_CACHE_MAX,
+    STATIC_HOT_ASSETS,
+)
+
+# path -> (mtime, size, etag, data) for small and hot assets (logo, hero image)
+_memory_cache = {}
+_memory_lock = threading.Lock()
+_memory_bytes = {"used": 0}
+
+
+# -----------------------------
+# HELPERS
+# -----------------------------
+def _resolve(filename):
+    """(path, accel_uri) for a bundled asset or, under images/, an upload."""
+    path = safe_join(current_app.static_folder, filename)
+    if path is not None and os.path.isfile(path):
+        return path, STATIC_ACCEL_PREFIX + filename
+
+    if filename.startswith("images/"):
+        name = filename[len("images/"):]
+        if "/" not in name and not name.endswith(PARTIAL_SUFFIX):
+            storage = get_storage()
+            if storage.exists(name):
+                return storage.path(name), UPLOADS_ACCEL_PREFIX + name
+
+    return None, None
+
+
+def _mimetype(path):
+    return mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+
+def _cached_bytes(path, st):
+    entry = _memory_cache.get(path)
+    if entry and entry[0] == st.st_mtime and entry[1] == st.st_size:
+        return entry
+
+    with open(path, "rb") as f:
+        data = f.read()
+    entry = (st.st_mtime, st.st_size, hashlib.sha1(data).hexdigest(), data)
+
+    with _memory_lock:
+        old = _memory_cache.get(path)
+        freed = old[1] if old else 0
+        if _memory_bytes["used"] - freed + len(data) <= STATIC_MEMORY_CACHE_MAX:
+            _memory_cache[path] = entry
+            _memory_bytes["used"] += len(data) - freed
+
+    return entry
+
+
+def _finish(response, size):
+    response.cache_control.public = True
+    response.cache_control.max_age = STATIC_MAX_AGE
+    return response.make_conditional(request, accept_ranges=True, complete_length=size)
+
+
+# -----------------------------
+# STATIC VIEW
+# -----------------------------
+def serve_static(filename):
+    path, accel_uri = _resolve(filename)
+    if path is None:
+        abort(404)
+
+    if STATIC_SERVE_MODE == "x-accel":
+        # nginx serves the bytes from internal locations mapped to
+        # app/static and UPLOAD_FOLDER
+        response = Response(mimetype=_mimetype(path))
+        response.headers["X-Accel-Redirect"] = accel_uri
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_MAX_AGE
+        return response
+
+    if STATIC_SERVE_MODE == "x-sendfile":
+        # Flask emits X-Sendfile when app.use_x_sendfile is set
+        return send_file(path, conditional=True, max_age=STATIC_MAX_AGE)
+
+    st = os.stat(path)
+
+    if st.st_size <= STATIC_SMALL_ASSET_MAX or filename in STATIC_HOT_ASSETS:
+        _, size, etag, data = _cached_bytes(path, st)
+        response = Response(data, mimetype=_mimetype(path))
+        response.set_etag(etag)
+        response.last_modified = st.st_mtime
+        return _finish(response, size)
+
+    # large files: wsgi.file_wrapper -> gunicorn uses sendfile(2)
+    return send_file(
+        path,
+        mimetype=_mimetype(path),
+        conditional=True,
+        etag=f"{int(st.st_mtime_ns)}-{st.st_size}",
+        max_age=STATIC_MAX_AGE,
+        last_modified=st.st_mtime,
+    )
+
+
+def init_static_serving(app):
+    if STATIC_SERVE_MODE == "x-sendfile":
+        app.use_x_sendfile = True
+
+    app.view_functions["static"] = serve_static
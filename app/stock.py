@@ -0,0 +1,433 @@
+from psycopg2.extras import execute_values
+
+from app import jobs
+from app.catalog import refresh_category_facets, notify_catalog_changed, invalidate_product
+from app.config import (
+    STOCK_HOLD_TTL,
+    STOCK_HOLD_SHARDS,
+    STOCK_HOLD_SWEEP_INTERVAL,
+    STOCK_FOLD_INTERVAL,
+)
+from app.database import get_db
+
+# Each product's stock is split across STOCK_HOLD_SHARDS counter rows in
+# stock_hold_shards: sum(capacity) == products.stock - sum(sold) and
+# held <= capacity per shard. A checkout reserves from one random unlocked
+# shard and records the units it sells in that shard's ``sold`` counter,
+# so concurrent buyers of a hot SKU update different rows and never touch
+# products.stock; fold_sold_stock moves the counters onto products.stock
+# in the background. Lock order is always orders -> holds -> shards (by
+# product, shard), and products -> shards for admin edits and the fold.
+
+# deleting an order in these statuses puts its units back on sale
+RESTOCK_ON_DELETE = ("PENDING", "CONFIRMED")
+
+
+# -----------------------------
+# SHARDS
+# -----------------------------
+def ensure_shards(cur, product_ids=None):
+    """Create counter rows, splitting current stock, for products that have none."""
+    cur.execute("""
+        INSERT INTO stock_hold_shards (product_id, shard, capacity, held)
+        SELECT p.id, s.shard,
+               GREATEST(p.stock, 0) / %(n)s
+                 + CASE WHEN s.shard < GREATEST(p.stock, 0) %% %(n)s THEN 1 ELSE 0 END,
+               0
+        FROM products p
+        CROSS JOIN generate_series(0, %(n)s - 1) AS s(shard)
+        WHERE (%(ids)s::int[] IS NULL OR p.id = ANY(%(ids)s::int[]))
+          AND NOT EXISTS (SELECT 1 FROM stock_hold_shards h WHERE h.product_id = p.id)
+        ON CONFLICT (product_id, shard) DO NOTHING
+    """, {"n": STOCK_HOLD_SHARDS, "ids": list(product_ids) if product_ids is not None else None})
+
+
+def rebalance(cur, product_id):
+    """Re-split free stock across shards after products.stock was changed directly.
+
+    Units sold since the last fold stay on their shards' counters and are
+    still subtracted when the fold runs.
+    """
+    ensure_shards(cur, [product_id])
+
+    cur.execute("SELECT stock FROM products WHERE id = %s", (product_id,))
+    row = cur.fetchone()
+    if row is None:
+        # product deleted
+        cur.execute("DELETE FROM stock_holds WHERE product_id = %s", (product_id,))
+        cur.execute("DELETE FROM stock_hold_shards WHERE product_id = %s", (product_id,))
+        return
+
+    cur.execute("""
+        SELECT shard, held, sold FROM stock_hold_shards
+        WHERE product_id = %s ORDER BY shard FOR UPDATE
+    """, (product_id,))
+    shards = cur.fetchall()
+
+    # stock below what's already held: no new holds until it recovers
+    on_hand = row["stock"] - sum(s["sold"] for s in shards)
+    free = max(on_hand - sum(s["held"] for s in shards), 0)
+    base, extra = divmod(free, len(shards))
+    for i, s in enumerate(shards):
+        cur.execute("""
+            UPDATE stock_hold_shards SET capacity = %s
+            WHERE product_id = %s AND shard = %s
+        """, (s["held"] + base + (1 if i < extra else 0), product_id, s["shard"]))
+
+
+def _release(cur, released):
+    """Give (product_id, shard, quantity) rows back to their shards."""
+    totals = {}
+    for r in released:
+        key = (r["product_id"], r["shard"])
+        totals[key] = totals.get(key, 0) + r["quantity"]
+
+    for (product_id, shard), quantity in sorted(totals.items()):
+        cur.execute("""
+            UPDATE stock_hold_shards SET held = GREATEST(held - %s, 0)
+            WHERE product_id = %s AND shard = %s
+        """, (quantity, product_id, shard))
+    return len(released)
+
+
+def _take(cur, product_id, quantity):
+    """Hold ``quantity`` units; [(shard, quantity)] or None if not available."""
+    # fast path: one random shard with room that nobody else has locked
+    cur.execute("""
+        UPDATE stock_hold_shards SET held = held + %(q)s
+        WHERE product_id = %(p)s AND shard = (
+            SELECT shard FROM stock_hold_shards
+            WHERE product_id = %(p)s AND capacity - held >= %(q)s
+            ORDER BY random()
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING shard
+    """, {"p": product_id, "q": quantity})
+    row = cur.fetchone()
+    if row:
+        return [(row["shard"], quantity)]
+
+    # slow path: free abandoned holds, then gather across every shard
+    cur.execute("""
+        DELETE FROM stock_holds
+        WHERE product_id = %s AND expires_at <= now()
+        RETURNING product_id, shard, quantity
+    """, (product_id,))
+    _release(cur, cur.fetchall())
+
+    cur.execute("""
+        SELECT shard, capacity - held AS free FROM stock_hold_shards
+        WHERE product_id = %s ORDER BY shard FOR UPDATE
+    """, (product_id,))
+    shards = cur.fetchall()
+    if sum(max(s["free"], 0) for s in shards) < quantity:
+        return None
+
+    parts, remaining = [], quantity
+    for s in shards:
+        if remaining == 0:
+            break
+        part = min(max(s["free"], 0), remaining)
+        if part:
+            cur.execute("""
+                UPDATE stock_hold_shards SET held = held + %s
+                WHERE product_id = %s AND shard = %s
+            """, (part, product_id, s["shard"]))
+            parts.append((s["shard"], part))
+            remaining -= part
+    return parts
+
+
+def _consume(cur, product_id, shard, quantity):
+    # a held unit becomes a sold unit: it leaves the shard's capacity and is
+    # counted against products.stock at the next fold
+    cur.execute("""
+        UPDATE stock_hold_shards
+        SET held = GREATEST(held - %s, 0), capacity = GREATEST(capacity - %s, 0),
+            sold = sold + %s
+        WHERE product_id = %s AND shard = %s
+    """, (quantity, quantity, quantity, product_id, shard))
+
+
+def _restock(cur, product_id, quantity):
+    # the reverse of _consume on any one shard; negative sold adds stock
+    cur.execute("""
+        UPDATE stock_hold_shards
+        SET capacity = capacity + %(q)s, sold = sold - %(q)s
+        WHERE product_id = %(p)s AND shard = COALESCE(
+            (SELECT shard FROM stock_hold_shards
+             WHERE product_id = %(p)s
+             ORDER BY random() LIMIT 1
+             FOR UPDATE SKIP LOCKED),
+            0
+        )
+    """, {"p": product_id, "q": quantity})
+
+
+def _cart_quantities(cart):
+    quantities = {}
+    for item in cart:
+        quantities[item["id"]] = quantities.get(item["id"], 0) + item["quantity"]
+    return sorted(quantities.items())
+
+
+# -----------------------------
+# HOLDS
+# -----------------------------
+def release_user_holds(cur, user_id):
+    cur.execute(
+        "DELETE FROM stock_holds WHERE user_id = %s RETURNING product_id, shard, quantity",
+        (user_id,)
+    )
+    return _release(cur, cur.fetchall())
+
+
+def reserve_cart(user_id, cart):
+    """Replace the user's holds with fresh STOCK_HOLD_TTL holds for ``cart``.
+
+    Returns the product ids that could not be held (empty on success), or
+    None if the database is unavailable.
+    """
+    conn = get_db()
+    if not conn:
+        return None
+
+    try:
+        cur = conn.cursor()
+        release_user_holds(cur, user_id)
+        quantities = _cart_quantities(cart)
+        ensure_shards(cur, [pid for pid, _ in quantities])
+
+        short = []
+        for product_id, quantity in quantities:
+            parts = _take(cur, product_id, quantity)
+            if parts is None:
+                short.append(product_id)
+                continue
+            for shard, part in parts:
+                cur.execute("""
+                    INSERT INTO stock_holds
+                        (user_id, product_id, shard, quantity, expires_at, created_at)
+                    VALUES (%s, %s, %s, %s, now() + make_interval(secs => %s), now())
+                """, (user_id, product_id, shard, part, STOCK_HOLD_TTL))
+
+        if short:
+            # all or nothing: keep no partial holds, but drop the old ones
+            conn.rollback()
+            release_user_holds(cur, user_id)
+        conn.commit()
+        return short
+    finally:
+        conn.close()
+
+
+def convert_holds(cur, user_id, cart):
+    """Turn the user's holds into sold stock inside the order transaction.
+
+    Units the holds don't cover (expired or cart changed) are taken on the
+    spot. Returns False if the cart can't be covered; the caller must then
+    roll back.
+    """
+    cur.execute("""
+        DELETE FROM stock_holds WHERE user_id = %s
+        RETURNING product_id, shard, quantity, expires_at > now() AS live
+    """, (user_id,))
+    holds = cur.fetchall()
+
+    # expired holds only give their units back
+    _release(cur, [h for h in holds if not h["live"]])
+
+    live = {}
+    for h in sorted(holds, key=lambda h: (h["product_id"], h["shard"])):
+        if h["live"]:
+            live.setdefault(h["product_id"], []).append((h["shard"], h["quantity"]))
+
+    quantities = _cart_quantities(cart)
+    ensure_shards(cur, [pid for pid, _ in quantities])
+
+    for product_id, quantity in quantities:
+        remaining = quantity
+        extra = []
+        for shard, held in live.pop(product_id, []):
+            used = min(held, remaining)
+            if used:
+                _consume(cur, product_id, shard, used)
+                remaining -= used
+            if held > used:
+                extra.append({"product_id": product_id, "shard": shard, "quantity": held - used})
+        _release(cur, extra)
+
+        if remaining:
+            parts = _take(cur, product_id, remaining)
+            if parts is None:
+                return False
+            for shard, part in parts:
+                _consume(cur, product_id, shard, part)
+
+    # holds for products no longer in the cart
+    _release(cur, [
+        {"product_id": pid, "shard": shard, "quantity": q}
+        for pid, parts in live.items() for shard, q in parts
+    ])
+
+    return True
+
+
+# -----------------------------
+# CANCELLED / DELETED ORDERS
+# -----------------------------
+def order_quantities(cur, order_id):
+    """[(product_id, quantity)] of an order, in lock order."""
+    cur.execute("""
+        SELECT product_id, sum(quantity) AS quantity FROM order_items
+        WHERE order_id = %s AND product_id IS NOT NULL
+        GROUP BY product_id ORDER BY product_id
+    """, (order_id,))
+    return [(r["product_id"], r["quantity"]) for r in cur.fetchall()]
+
+
+def restock(cur, quantities):
+    """Put an order's units back on sale inside the cancelling transaction."""
+    ensure_shards(cur, [pid for pid, _ in quantities])
+    for product_id, quantity in quantities:
+        _restock(cur, product_id, quantity)
+
+
+def take_stock(cur, quantities):
+    """Sell an order's units again (un-cancelling); product ids that fall short.
+
+    On a non-empty result the caller must roll back.
+    """
+    ensure_shards(cur, [pid for pid, _ in quantities])
+    short = []
+    for product_id, quantity in quantities:
+        parts = _take(cur, product_id, quantity)
+        if parts is None:
+            short.append(product_id)
+            continue
+        for shard, part in parts:
+            _consume(cur, product_id, shard, part)
+    return short
+
+
+# -----------------------------
+# FOLD (shard counters -> products.stock)
+# -----------------------------
+def fold_sold_stock():
+    """Apply the shards' sold counters to products.stock.
+
+    Products that sold out or came back in stock get their category facets
+    and catalog caches refreshed here, off the order path. Returns the
+    number of products whose stock changed.
+    """
+    conn = get_db()
+    if not conn:
+        raise RuntimeError("Database unavailable")
+
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT DISTINCT product_id FROM stock_hold_shards WHERE sold <> 0")
+        product_ids = sorted(r["product_id"] for r in cur.fetchall())
+        if not product_ids:
+            conn.commit()
+            return 0
+
+        # products before shards, like an admin stock edit
+        cur.execute(
+            "SELECT id FROM products WHERE id = ANY(%s) ORDER BY id FOR UPDATE",
+            (product_ids,)
+        )
+        cur.execute("""
+            SELECT product_id, shard, sold FROM stock_hold_shards
+            WHERE product_id = ANY(%s) AND sold <> 0
+            ORDER BY product_id, shard FOR UPDATE
+        """, (product_ids,))
+        shards = cur.fetchall()
+
+        totals = {}
+        for s in shards:
+            totals[s["product_id"]] = totals.get(s["product_id"], 0) + s["sold"]
+
+        execute_values(cur, """
+            UPDATE stock_hold_shards h SET sold = h.sold - v.sold
+            FROM (VALUES %s) AS v(product_id, shard, sold)
+            WHERE h.product_id = v.product_id AND h.shard = v.shard
+        """, [(s["product_id"], s["shard"], s["sold"]) for s in shards])
+        changed = execute_values(cur, """
+            UPDATE products p SET stock = p.stock - v.sold
+            FROM (VALUES %s) AS v(id, sold)
+            WHERE p.id = v.id
+            RETURNING p.id, p.stock, p.stock + v.sold AS before
+        """, sorted(totals.items()), fetch=True)
+
+        flipped = [r["id"] for r in changed if (r["before"] > 0) != (r["stock"] > 0)]
+        if flipped:
+            refresh_category_facets(cur)
+            for product_id in flipped:
+                notify_catalog_changed(cur, product_id)
+        conn.commit()
+    finally:
+        conn.close()
+
+    for product_id in flipped:
+        invalidate_product(product_id)
+    return len(changed)
+
+
+@jobs.register("fold_sold_stock")
+def fold_sold_stock_job(payload):
+    folded = fold_sold_stock()
+    if folded:
+        print("STOCK FOLDED:", folded, "product(s)")
+
+
+jobs.every(STOCK_FOLD_INTERVAL, "fold_sold_stock")
+
+
+def load_availability(product_ids):
+    """product_id -> units not sold and not held."""
+    conn = get_db()
+    if not conn:
+        return {}
+
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT product_id, available FROM product_availability WHERE product_id = ANY(%s)",
+            (list(product_ids),)
+        )
+        return {r["product_id"]: max(r["available"], 0) for r in cur.fetchall()}
+    finally:
+        conn.close()
+
+
+# -----------------------------
+# EXPIRY SWEEPER
+# -----------------------------
+def release_expired_holds():
+    conn = get_db()
+    if not conn:
+        raise RuntimeError("Database unavailable")
+
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            DELETE FROM stock_holds WHERE expires_at <= now()
+            RETURNING product_id, shard, quantity
+        """)
+        released = _release(cur, cur.fetchall())
+        conn.commit()
+        return released
+    finally:
+        conn.close()
+
+
+@jobs.register("release_expired_holds")
+def release_expired_holds_job(payload):
+    released = release_expired_holds()
+    if released:
+        print("STOCK HOLDS EXPIRED:", released)
+
+
+jobs.every(STOCK_HOLD_SWEEP_INTERVAL, "release_expired_holds")
@@ -0,0 +1,279 @@
+import hashlib
+import os
+import uuid
+
+from flask import Request
+
+from app.config import (
+    UPLOAD_FOLDER,
+    STORAGE_BACKEND,
+    MAX_IMAGE_BYTES,
+    MAX_IMAGE_DIMENSION,
+)
+
+CHUNK_SIZE = 64 * 1024
+
+# enough for JPEGs whose SOF marker sits behind a large EXIF block
+HEADER_PROBE_BYTES = 256 * 1024
+
+# files still being written; never served or collected
+PARTIAL_SUFFIX = ".part"
+
+
+class UploadError(ValueError):
+    pass
+
+
+# -----------------------------
+# IMAGE HEADER PARSING
+# -----------------------------
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def image_dimensions(header):
+    """(width, height) from the first bytes of a PNG/JPEG/WEBP, or None."""
+    if header.startswith(b"\x89PNG\r\n\x1a\n") and len(header) >= 24:
+        return (
+            int.from_bytes(header[16:20], "big"),
+            int.from_bytes(header[20:24], "big"),
+        )
+
+    if header.startswith(b"\xff\xd8"):
+        i = 2
+        while i + 9 < len(header):
+            if header[i] != 0xFF:
+                i += 1
+                continue
+            marker = header[i + 1]
+            if marker == 0xFF:
+                i += 1
+                continue
+            if marker in _JPEG_SOF:
+                return (
+                    int.from_bytes(header[i + 7:i + 9], "big"),
+                    int.from_bytes(header[i + 5:i + 7], "big"),
+                )
+            i += 2 + int.from_bytes(header[i + 2:i + 4], "big")
+        return None
+
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP" and len(header) >= 30:
+        chunk = header[12:16]
+        if chunk == b"VP8 ":
+            return (
+                int.from_bytes(header[26:28], "little") & 0x3FFF,
+                int.from_bytes(header[28:30], "little") & 0x3FFF,
+            )
+        if chunk == b"VP8L":
+            bits = int.from_bytes(header[21:25], "little")
+            return ((bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1)
+        if chunk == b"VP8X":
+            return (
+                int.from_bytes(header[24:27], "little") + 1,
+                int.from_bytes(header[27:30], "little") + 1,
+            )
+
+    return None
+
+
+def _check_header(header):
+    dims = image_dimensions(header)
+    if dims is None:
+        raise UploadError("Unrecognised or corrupt image file")
+
+    width, height = dims
+    if not width or not height:
+        raise UploadError("Unrecognised or corrupt image file")
+    if width > MAX_IMAGE_DIMENSION or height > MAX_IMAGE_DIMENSION:
+        raise UploadError(
+            f"Images must be at most {MAX_IMAGE_DIMENSION}px on each side"
+        )
+
+
+def _too_large():
+    return UploadError(f"Images must be under {MAX_IMAGE_BYTES // (1024 * 1024)} MB")
+
+
+# -----------------------------
+# UPLOADS CHECKED WHILE THE BODY IS PARSED
+# -----------------------------
+class UploadSpool:
+    """File object werkzeug's multipart parser writes a file part into.
+
+    Each chunk is size-limited, header-checked and hashed as it comes off
+    the socket and goes straight to a .part file in the storage root, so
+    LocalStorage.save only has to rename it. After the first failure the
+    rest of the part is discarded instead of written; the parser still
+    reads it, bounded by MAX_CONTENT_LENGTH.
+    """
+
+    def __init__(self, root):
+        self.tmp = os.path.join(root, f".{uuid.uuid4().hex}{PARTIAL_SUFFIX}")
+        self._file = open(self.tmp, "w+b")
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.header = b""
+        self.checked = False
+        self.error = None
+        self.stored = False
+
+    def write(self, chunk):
+        if self.error is None:
+            try:
+                self._feed(chunk)
+            except UploadError as e:
+                self.error = e
+                self._file.truncate(0)
+        return len(chunk)
+
+    def _feed(self, chunk):
+        self.size += len(chunk)
+        if self.size > MAX_IMAGE_BYTES:
+            raise _too_large()
+
+        if not self.checked:
+            self.header += chunk
+            if image_dimensions(self.header) or len(self.header) >= HEADER_PROBE_BYTES:
+                _check_header(self.header)
+                self.checked = True
+                self.header = b""
+
+        self.digest.update(chunk)
+        self._file.write(chunk)
+
+    def finish(self):
+        """Close the .part file; raises the first UploadError seen."""
+        if self.error is None and not self.checked:
+            try:
+                _check_header(self.header)
+            except UploadError as e:
+                self.error = e
+        self._file.close()
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        # end of request: drop parts nobody saved
+        self._file.close()
+        if not self.stored and os.path.exists(self.tmp):
+            os.remove(self.tmp)
+
+    def __getattr__(self, name):
+        # seek/read/tell/seekable for werkzeug and any other reader
+        return getattr(self._file, name)
+
+
+class SpooledUploadRequest(Request):
+    """Request whose file parts are streamed into the storage backend."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        open_upload = getattr(get_storage(), "open_upload", None)
+        if open_upload is None:
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        return open_upload()
+
+
+# -----------------------------
+# LOCAL FILESYSTEM BACKEND
+# -----------------------------
+class LocalStorage:
+    """Content-addressed files: <sha256><ext>, so identical uploads are stored once."""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, name):
+        return os.path.join(self.root, os.path.basename(name))
+
+    def exists(self, name):
+        return os.path.isfile(self.path(name))
+
+    def open_upload(self):
+        return UploadSpool(self.root)
+
+    def save(self, stream, ext):
+        if isinstance(stream, UploadSpool):
+            # already checked and hashed while the request was parsed
+            stream.finish()
+            name = self._store(stream.tmp, stream.digest, ext)
+            stream.stored = True
+            return name
+
+        tmp = os.path.join(self.root, f".{uuid.uuid4().hex}{PARTIAL_SUFFIX}")
+        digest = hashlib.sha256()
+        size = 0
+        header = b""
+        checked = False
+
+        try:
+            with open(tmp, "wb") as out:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+
+                    size += len(chunk)
+                    if size > MAX_IMAGE_BYTES:
+                        raise _too_large()
+
+                    # reject oversized or non-images before reading the rest
+                    if not checked:
+                        header += chunk
+                        if image_dimensions(header) or len(header) >= HEADER_PROBE_BYTES:
+                            _check_header(header)
+                            checked = True
+
+                    digest.update(chunk)
+                    out.write(chunk)
+
+            if not checked:
+                _check_header(header)
+
+            return self._store(tmp, digest, ext)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def _store(self, tmp, digest, ext):
+        name = f"{digest.hexdigest()}{ext}"
+        final = self.path(name)
+
+        if os.path.exists(final):
+            # already stored; refresh mtime so the GC grace period restarts
+            os.utime(final)
+            os.remove(tmp)
+        else:
+            os.replace(tmp, final)
+
+        return name
+
+    def delete(self, name):
+        try:
+            os.remove(self.path(name))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def list(self):
+        """(name, mtime) for every stored file."""
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if entry.is_file() and not entry.name.startswith("."):
+                    yield entry.name, entry.stat().st_mtime
+
+
+BACKENDS = {
+    "local": lambda: LocalStorage(UPLOAD_FOLDER),
+}
+
+_storage = {}
+
+
+def get_storage():
+    if "backend" not in _storage:
+        try:
+            _storage["backend"] = BACKENDS[STORAGE_BACKEND]()
+        except KeyError:
+            raise RuntimeError(f"Unknown STORAGE_BACKEND {STORAGE_BACKEND!r}")
+    return _storage["backend"]
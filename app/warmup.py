@@ -0,0 +1,60 @@
+import os
+import time
+from contextlib import contextmanager
+
+from jinja2 import FileSystemBytecodeCache
+
+from app.config import JINJA_CACHE_DIR
+
+
+# -----------------------------
+# STARTUP TIMING
+# -----------------------------
+class StartupTimer:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, (time.perf_counter() - start) * 1000))
+
+    def report(self):
+        total = (time.perf_counter() - self.started) * 1000
+        print(f"STARTUP ({os.getpid()}): {total:.0f}ms total")
+        for name, ms in self.phases:
+            print(f"  {name:<24} {ms:8.1f}ms")
+
+
+# -----------------------------
+# WARM-UP STEPS
+# -----------------------------
+def enable_bytecode_cache(app):
+    os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(JINJA_CACHE_DIR)
+
+
+def precompile_templates(app):
+    # compiled templates stay in jinja_env.cache, which forked workers inherit
+    for name in app.jinja_env.list_templates(extensions=["html"]):
+        app.jinja_env.get_template(name)
+
+
+def warm_catalog():
+    from app.catalog import load_product_cards, load_category_facets, flush_snapshot
+    load_product_cards()
+    load_category_facets()
+    # the master has no listener thread to flush for it
+    flush_snapshot()
+
+
+def warm_up(app, timer):
+    with timer.phase("templates"):
+        precompile_templates(app)
+
+    with timer.phase("catalog cache"):
+        warm_catalog()
@@ -0,0 +1,24 @@
+import os
+
+# Import the app once in the master (templates compiled, catalog cache
+# warm) and fork workers from it.
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") == "1"
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "30"))
+
+# Threaded workers: an open admin live feed (SSE) holds one thread, not a
+# whole worker. Keep ORDER_FEED_MAX_CLIENTS below the thread count, and
+# DB_CONCURRENCY_LIMIT (app/config.py, derived from GUNICORN_THREADS by
+# default) below it too, or the per-worker DB cap never sheds load.
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.environ.get("GUNICORN_THREADS", "8"))
+
+
+def post_fork(server, worker):
+    # per-process DB state: breaker verdict and the LISTEN thread
+    from app.database import reset_after_fork
+    from app.listener import start_listener
+
+    reset_after_fork()
+    start_listener()